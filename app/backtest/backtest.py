@@ -1,4 +1,6 @@
+import math
 import warnings
+from typing import Tuple
 
 import numpy as np
 import pandas as pd
@@ -7,6 +9,7 @@ import plotly.subplots as sp
 from scipy.optimize import curve_fit
 
 from app import slack
+from app.backtest.ledger import BUY, HOLD, SELL, Ledger, RowView
 from app.utils import get_current_dir, write_to_log
 
 warnings.filterwarnings("ignore")
@@ -17,6 +20,13 @@ CURRENT_DIR = get_current_dir()
 
 
 class Backtest:
+    # "loop" calls trade() row by row, "vectorized" simulates signals() arrays
+    engine = "loop"
+    # strategies implementing signals() set this, others always run the loop
+    vectorizable = False
+    # parameter sweeps only keep the summary returns: no results CSV, log or plot
+    sweep = False
+
     def __init__(self, **kwargs):
         self.kwargs = kwargs
         self.tax_rate = 0.001
@@ -31,10 +41,16 @@ class Backtest:
 
         self.df = df
         self.preprocess()
-        for i in range(len(df)):
-            self.trade(df.iloc[i])
+        self.ledger = Ledger(len(self.df))
+        if self.engine == "vectorized" and self.vectorizable:
+            self.simulate(*self.signals())
+        else:
+            columns = {col: self.df[col].to_numpy() for col in self.df.columns}
+            for i, name in enumerate(self.df.index):
+                self.trade(RowView(i, name, columns))
         self.consolidate_results()
-        self.plot_results()
+        if not self.sweep:
+            self.plot_results()
 
     def preprocess(self) -> None:
         """
@@ -49,6 +65,58 @@ class Backtest:
         """
         return
 
+    def signals(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized counterpart of trade(), defined in child class along with
+        vectorizable = True. Returns one action code (HOLD/BUY/SELL) and one
+        size per row, size being the fraction of cash (BUY) or shares (SELL)
+        to trade. Holds on every row by default.
+        """
+        n = len(self.df)
+        return np.full(n, HOLD), np.zeros(n)
+
+    def simulate(self, actions: np.ndarray, sizes: np.ndarray) -> None:
+        """
+        Positions, capital, fees and equity of the signals() arrays.
+        Only the traded amounts need a loop, over the trading rows, since each
+        depends on the cash or shares left by the previous trades. Fees and
+        equity then come from whole columns: cumulative shares and capital.
+        Mirrors buy/sell/hold/calculate_equity, so both engines give the same numbers.
+        """
+        close = self.df["close"].values.astype(np.float64)
+        price = close * 1000
+        actions = np.asarray(actions)
+        sizes = np.asarray(sizes, dtype=np.float64)
+        buy, sell = actions == BUY, actions == SELL
+
+        # shares bought (> 0) or sold (< 0) on each row
+        traded = np.zeros(len(close))
+        capital, shares = self.capital, self.shares
+        for i in np.flatnonzero(buy | sell).tolist():
+            if buy[i]:
+                amount = math.floor(sizes[i] * capital / price[i])
+            else:
+                amount = -math.floor(sizes[i] * shares)
+            traded[i] = amount
+            shares += amount
+            capital -= amount * price[i]
+
+        value = np.abs(traded) * price
+        fees = np.where(buy, self.transaction_fee * value, 0.0)
+        fees = np.where(sell, (self.tax_rate + self.transaction_fee) * value, fees)
+        cash_flow = np.where(traded != 0, -traded * price, 0.0)
+        capital_held = np.cumsum(np.concatenate([[self.capital], cash_flow]))[1:]
+        shares_held = self.shares + np.cumsum(traded)
+
+        ledger = self.ledger
+        ledger.action[:] = actions
+        ledger.sizing[:] = np.where(actions == HOLD, 0, sizes)
+        ledger.shares_buyable[buy] = traded[buy]
+        ledger.shares_sellable[sell] = np.abs(traded[sell])
+        ledger.fees[:] = fees
+        ledger.equity[:] = (shares_held * close * 1000 + capital_held) - fees
+        self.capital, self.shares = capital, shares
+
     def position_sizing(self) -> float:
         """
         Can override with more sophisticated position sizing approaches.
@@ -74,45 +142,45 @@ class Backtest:
         popt, pcov = curve_fit(self.func, x, y)
         return popt
 
-    def buy(self, row: pd.Series, sizing: bool = True) -> None:
+    def buy(self, row: RowView, sizing: bool = True) -> None:
         size, buy_amount = self.shares_buyable(row, sizing)
         self.shares += buy_amount
         shares_value = buy_amount * (row["close"] * 1000)
         self.capital -= shares_value
-        self.df.loc[row.name, "action"] = "BUY"
-        self.df.loc[row.name, "sizing"] = size
-        self.df.loc[row.name, "shares_buyable"] = buy_amount
-        self.df.loc[row.name, "fees"] = (self.transaction_fee) * shares_value
+        self.ledger.action[row.position] = BUY
+        self.ledger.sizing[row.position] = size
+        self.ledger.shares_buyable[row.position] = buy_amount
+        self.ledger.fees[row.position] = (self.transaction_fee) * shares_value
 
-    def sell(self, row: pd.Series, sizing: bool = False) -> None:
+    def sell(self, row: RowView, sizing: bool = False) -> None:
         size, sell_amount = self.shares_sellable(row, sizing)
         shares_value = sell_amount * (row["close"] * 1000)
         self.capital += shares_value
         self.shares -= sell_amount
-        self.df.loc[row.name, "action"] = "SELL"
-        self.df.loc[row.name, "sizing"] = size
-        self.df.loc[row.name, "shares_sellable"] = sell_amount
-        self.df.loc[row.name, "fees"] = (
+        self.ledger.action[row.position] = SELL
+        self.ledger.sizing[row.position] = size
+        self.ledger.shares_sellable[row.position] = sell_amount
+        self.ledger.fees[row.position] = (
             self.tax_rate + self.transaction_fee
         ) * shares_value
 
-    def hold(self, row) -> None:
-        self.df.loc[row.name, "action"] = "HOLD"
-        self.df.loc[row.name, "sizing"] = 0
-        self.df.loc[row.name, "fees"] = 0
+    def hold(self, row: RowView) -> None:
+        self.ledger.action[row.position] = HOLD
+        self.ledger.sizing[row.position] = 0
+        self.ledger.fees[row.position] = 0
 
-    def shares_buyable(self, row: pd.Series, sizing: bool = True) -> int:
+    def shares_buyable(self, row: RowView, sizing: bool = True) -> int:
         size = self.position_sizing() if sizing else 1
         return size, np.floor(size * self.capital / (row["close"] * 1000))
 
-    def shares_sellable(self, row: pd.Series, sizing: bool = False) -> int:
+    def shares_sellable(self, row: RowView, sizing: bool = False) -> int:
         size = self.position_sizing() if sizing else 1
         return size, np.floor(size * self.shares)
 
-    def calculate_equity(self, row: pd.Series) -> None:
-        self.df.loc[row.name, "equity"] = (
+    def calculate_equity(self, row: RowView) -> None:
+        self.ledger.equity[row.position] = (
             self.shares * row["close"] * 1000 + self.capital
-        ) - self.df.loc[row.name, "fees"]
+        ) - self.ledger.fees[row.position]
 
     @staticmethod
     def resample_returns(returns: float, n: int = 1, m: int = 1) -> float:
@@ -191,6 +259,7 @@ class Backtest:
             slack.send_file(self.PLOT)
 
     def consolidate_results(self) -> None:
+        self.df = self.ledger.materialize(self.df)
         self.df["returns"] = self.df["equity"] / self.df["equity"].shift() - 1
         self.df["accum_returns"] = self.df["equity"] / self.initial_capital - 1
         action_values = (
@@ -200,6 +269,11 @@ class Backtest:
         annualized_returns = self.__class__.resample_returns(
             total_returns, n=250, m=len(self.df)
         )
+        self.total_returns = total_returns
+        self.annualized_returns = annualized_returns
+        if self.sweep:
+            return
+
         self.df.to_csv(self.RESULTS)
         if not self.backtest:
             last = self.df.iloc[-1]
@@ -1,5 +1,4 @@
 import argparse
-import calendar
 import warnings
 from typing import List, Tuple
 from datetime import datetime
@@ -9,8 +8,15 @@ import pandas as pd
 
 from app import slack
 from app.backtest.backtest import Backtest
+from app.backtest.correlated_pair.rules import compile_rules, get_rules
+from app.backtest.ledger import BUY, SELL, RowView
 from app.historical_price import HistoricalPrice
-from app.models.regime_clustering.regime_clustering import cluster
+from app.models.regime_clustering.batch import read_states
+from app.models.regime_clustering.regime_clustering import (
+    LAGS,
+    cluster,
+    online_cluster,
+)
 from app.scrapers.vndirect import Ticker
 from app.utils import get_current_dir
 
@@ -21,1123 +27,115 @@ CURRENT_DIR = get_current_dir()
 
 
 class CorrelatedPairStrategy(Backtest):
+    # decisions are compiled from the pair's rule table, see rules.py
+    engine = "vectorized"
+    vectorizable = True
+    # (func, popt) of the weekly returns fit, can be passed in precomputed
+    fit = None
+    # rule table, looked up by pair in rules.json unless passed in
+    rules = None
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.LOG_NAME = f"correlated_pair_backtest_{'_'.join(self.pair)}"
         self.RESULTS = f"{CURRENT_DIR}/{'_'.join(self.pair)}.csv"
         self.PLOT = f"{CURRENT_DIR}/{'_'.join(self.pair)}.html"
 
-        self.deviation = []
-        self.week = None
-        self.days_past = None
+        if self.rules is None:
+            self.rules = get_rules(self.pair)
+        self.period = self.rules["period"]
 
     def position_sizing(self) -> float:
-        return min((np.abs(self.deviation[-1]) / self.max_dev), self.max_portion)
+        return np.minimum(np.abs(self.deviation) / self.max_dev, self.max_portion)
 
     def preprocess(self) -> None:
-        hp = HistoricalPrice()
-        weekly_returns = hp.get_returns(freq="weekly", tickers=self.pair)
-        x, y = (
-            weekly_returns.loc[:, self.pair]
-            .sort_values(by=[self.pair[0]], ascending=True)
-            .dropna()
-            .values
-        ).T
-        self.popt = self.fit_func(x, y, self.degree)
-
-    def get_key_dates(self, row: pd.Series) -> Tuple:
-        today = row.name
-        year = today.year
-        month = str(today.month).zfill(2)
-        days_in_month = calendar.monthrange(today.year, today.month)[1]
-
-        first_trading_day = self.df.loc[f"{year}-{month}-01":, :].index[0]
-        today = today.strftime("%Y-%m-%d")
-        temp = self.df.loc[first_trading_day:today, :]
-
-        days_past = len(temp) - 1
-        return first_trading_day, today, days_in_month, days_past
-
-
-class test(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0:
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.buy(row, sizing=True)
-                else:
-                    self.buy(row, sizing=True)
-        self.calculate_equity(row)
-
-
-class CTG_HDB(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 0
-            ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 1 or row["state_5"] == 1 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.buy(row, sizing=False)
-        self.calculate_equity(row)
-
-
-class MBB_VND(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 0
-            ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 1 or row["state_5"] == 1 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.buy(row, sizing=False)
-            else:
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.buy(row, sizing=False)
-        self.calculate_equity(row)
-
-
-# class STB_LPB(CorrelatedPairStrategy):
-#     def trade(self, row: pd.Series) -> None:
-#         today = row.name
-
-#         if self.week is None or self.week != self.df.loc[today, "week"]:
-#             """
-#             START NEW WEEK
-#             - Reset days_past
-#             - Use last week closing as this week opening
-#             """
-#             first_date = today.strftime("%Y-%m-%d")
-#             self.week = self.df.loc[today, "week"]
-#             self.days_past = 1
-#             self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-#             self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-#         else:
-#             self.days_past += 1
-
-#         return_x = super().resample_returns(
-#             returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-#             - 1,
-#             m=self.days_past,
-#         )
-
-#         return_y = super().resample_returns(
-#             returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-#             - 1,
-#             m=self.days_past,
-#         )
-
-#         weekly_return_x = (1 + return_x) ** (5) - 1
-#         pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-#         pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-#         dev = pred_return_y - return_y
-#         self.deviation.append(dev)
-
-#         # Y is over-valued by a factor
-#         if return_y >= self.multiplier * pred_return_y:
-#             if return_y > 0 and (
-#                 row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 0
-#             ):
-#                 if return_x > 0:
-#                     self.hold(row)
-#                 else:
-#                     self.sell(row)
-#             else:
-#                 if return_x > 0:
-#                     self.hold(row)
-#                 else:
-#                     self.sell(row)
-
-#         # Y is undervalued by a factor
-#         elif return_y < self.multiplier * pred_return_y:
-#             if return_y > 0 and (
-#                 row["state_3"] == 1 or row["state_5"] == 1 or row["state_200"] == 1
-#             ):
-#                 if return_x > 0:
-#                     self.buy(row, sizing=False)
-#                 else:
-#                     self.hold(row)
-#             else:
-#                 if return_x > 0:
-#                     self.hold(row)
-#                 else:
-#                     self.hold(row)
-#         self.calculate_equity(row)
-
-
-class VCI_FTS(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_5"] == 1 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 1 or row["state_20"] == 0 or row["state_200"] == 0
-            ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.buy(row, sizing=False)
-            else:
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.buy(row, sizing=False)
-        self.calculate_equity(row)
-
-
-class VCI_CTS(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 1 or row["state_5"] == 0 or row["state_200"] == 0
-            ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_20"] == 1 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.buy(row, sizing=False)
-        self.calculate_equity(row)
-
-
-class MBS_BSI(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_20"] == 0 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.buy(row, sizing=True)
-                else:
-                    self.buy(row, sizing=False)
-        self.calculate_equity(row)
-
-
-class CTS_FTS(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_20"] == 0 or row["state_200"] == 0
-            ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.buy(row, sizing=False)
-        self.calculate_equity(row)
-
-
-class VGS_TLH(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 0
-            ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.hold(row)
+        if self.fit is None:
+            self.fit = fit_weekly_returns(self.pair, self.degree)
+        self.func, self.popt = self.fit
+
+        returns = self.period_returns()
+        for col in returns.columns:
+            self.df[col] = returns[col]
+        self.df["deviation"] = self.df["pred_return_y"] - self.df["return_y"]
+        self.actions, self.sized = compile_rules(self.rules, self.df, self.multiplier)
+
+    def period_returns(self) -> pd.DataFrame:
+        """
+        Period-to-date returns of both legs, resampled to daily,
+        and the predicted daily returns of the target, for all rows at once.
+        """
+        returns = period_to_date(self.df, self.pair, self.period)
+        days_past = returns["days_past"].values
+        ratios = [
+            self.df[f"{p}_close"].values / returns[f"{p}_period_open"].values
+            for p in self.pair
+        ]
+        # price ratios stay in the prices' dtype, returns are float64
+        return_x, return_y = [ratio.astype(np.float64) - 1 for ratio in ratios]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.period == "weekly":
+                return_x = super().resample_returns(return_x, m=days_past)
+                return_y = super().resample_returns(return_y, m=days_past)
+                weekly_return_x = (1 + return_x) ** (5) - 1
+                pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
+                pred_return_y = super().resample_returns(pred_weekly_return_y, m=5)
             else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_20"] == 0 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.buy(row, sizing=False)
-        self.calculate_equity(row)
-
-
-class VCG_DIG(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 0
-            ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0 and (
-                row["state_3"] == 1 or row["state_20"] == 1 or row["state_200"] == 1
-            ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.buy(row, sizing=False)
-            else:
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-        self.calculate_equity(row)
-
-
-class PLX_PVS(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        today = row.name
-
-        if self.week is None or self.week != self.df.loc[today, "week"]:
-            """
-            START NEW WEEK
-            - Reset days_past
-            - Use last week closing as this week opening
-            """
-            first_date = today.strftime("%Y-%m-%d")
-            self.week = self.df.loc[today, "week"]
-            self.days_past = 1
-            self.week_open_pair_0 = self.df.loc[first_date, f"{self.pair[0]}_open"]
-            self.week_open_pair_1 = self.df.loc[first_date, f"{self.pair[1]}_open"]
-        else:
-            self.days_past += 1
-
-        return_x = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[0]}_close"] / self.week_open_pair_0
-            - 1,
-            m=self.days_past,
-        )
-
-        return_y = super().resample_returns(
-            returns=self.df.loc[today, f"{self.pair[1]}_close"] / self.week_open_pair_1
-            - 1,
-            m=self.days_past,
-        )
-
-        weekly_return_x = (1 + return_x) ** (5) - 1
-        pred_weekly_return_y = self.func(weekly_return_x, *self.popt)
-
-        pred_return_y = super().resample_returns(returns=pred_weekly_return_y, m=5)
-
-        dev = pred_return_y - return_y
-        self.deviation.append(dev)
-
-        # Y is over-valued by a factor
-        if return_y >= self.multiplier * pred_return_y:
-            if return_y > 0:  # and (
-                # row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 1
-                # ):
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-            else:
-                if return_x > 0:
-                    self.hold(row)
-                else:
-                    self.sell(row)
-
-        # Y is undervalued by a factor
-        elif return_y < self.multiplier * pred_return_y:
-            if return_y > 0:  # and (
-                # row["state_3"] == 0 or row["state_20"] == 0 or row["state_200"] == 0
-                # ):
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-            else:
-                if return_x > 0:
-                    self.buy(row, sizing=False)
-                else:
-                    self.hold(row)
-        self.calculate_equity(row)
-
-
-class PLP_DRH(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        first_trading_day, today, days_in_month, days_past = self.get_key_dates(row)
-        if days_past > 0:
-            return_x = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[0]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[0]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            return_y = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[1]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[1]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            monthly_return_x = super().resample_returns(
-                returns=return_x, n=days_in_month - 1
-            )
-            pred_monthly_return_y = self.func(monthly_return_x, *self.popt)
-
-            pred_return_y = super().resample_returns(
-                returns=pred_monthly_return_y, m=days_in_month - 1
-            )
-            dev = pred_return_y - return_y
-            self.deviation.append(dev)
-
-            # Y is over-valued by a factor
-            if return_y >= self.multiplier * pred_return_y:
-                if return_y > 0 and (
-                    row["state_3"] == 0 or row["state_5"] == 1 or row["state_200"] == 0
-                ):
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.hold(row)
-                else:
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.sell(row)
-
-            # Y is undervalued by a factor
-            elif return_y < self.multiplier * pred_return_y:
-                if return_y > 0 and (
-                    row["state_3"] == 0 or row["state_20"] == 1 or row["state_200"] == 0
-                ):
-                    if return_x > 0:
-                        self.buy(row, sizing=False)
-                    else:
-                        self.hold(row)
-                else:
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.buy(row, sizing=False)
-
+                # no returns yet on the first trading day of the month
+                started = days_past > 0
+                days_in_month = self.df.index.days_in_month.values - 1
+                return_x = np.where(
+                    started, super().resample_returns(return_x, m=days_past), np.nan
+                )
+                return_y = np.where(
+                    started, super().resample_returns(return_y, m=days_past), np.nan
+                )
+                monthly_return_x = super().resample_returns(return_x, n=days_in_month)
+                pred_monthly_return_y = self.func(monthly_return_x, *self.popt)
+                pred_return_y = super().resample_returns(
+                    pred_monthly_return_y, m=days_in_month
+                )
+
+        returns["return_x"] = return_x
+        returns["return_y"] = return_y
+        returns["pred_return_y"] = pred_return_y
+        return returns
+
+    def trade(self, row: RowView) -> None:
+        """
+        Row-by-row replay of the compiled rule table.
+        """
+        self.deviation = row["deviation"]
+        action = self.actions[row.position]
+        if action == BUY:
+            self.buy(row, sizing=self.sized[row.position])
+        elif action == SELL:
+            self.sell(row)
         else:
             self.hold(row)
         self.calculate_equity(row)
 
+    def signals(self) -> Tuple[np.ndarray, np.ndarray]:
+        self.deviation = self.df["deviation"].values
+        sizes = np.where(self.sized, self.position_sizing(), 1)
+        return self.actions, sizes
 
-class PDR_MBS(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        first_trading_day, today, days_in_month, days_past = self.get_key_dates(row)
-        if days_past > 0:
-            return_x = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[0]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[0]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            return_y = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[1]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[1]}_close"]
-                - 1,
-                m=days_past,
-            )
-            monthly_return_x = super().resample_returns(
-                returns=return_x, n=days_in_month - 1
-            )
-            pred_monthly_return_y = self.func(monthly_return_x, *self.popt)
-
-            pred_return_y = super().resample_returns(
-                returns=pred_monthly_return_y, m=days_in_month - 1
-            )
-            dev = pred_return_y - return_y
-            self.deviation.append(dev)
-
-            # Y is over-valued by a factor
-            if return_y >= self.multiplier * pred_return_y:
-                if return_y > 0:  # and (row["state_3"] == 0 or row["state_5"] == 1):
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.hold(row)
-                else:
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.sell(row)
 
-            # Y is undervalued by a factor
-            elif return_y < self.multiplier * pred_return_y:
-                if return_y > 0:  # and (row["state_3"] == 1 or row["state_20"] == 0):
-                    if return_x > 0:
-                        # self.buy(row)
-                        self.buy(row, sizing=False)
-                    else:
-                        self.hold(row)
-                else:
-                    if return_x > 0:
-                        self.buy(row, sizing=False)
-                    else:
-                        # self.buy(row)
-                        self.buy(row, sizing=False)
-        else:
-            self.hold(row)
-        self.calculate_equity(row)
-
-
-class HAP_EVG(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        first_trading_day, today, days_in_month, days_past = self.get_key_dates(row)
-        if days_past > 0:
-            return_x = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[0]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[0]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            return_y = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[1]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[1]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            monthly_return_x = super().resample_returns(
-                returns=return_x, n=days_in_month - 1
-            )
-            pred_monthly_return_y = self.func(monthly_return_x, *self.popt)
-
-            pred_return_y = super().resample_returns(
-                returns=pred_monthly_return_y, m=days_in_month - 1
-            )
-            dev = pred_return_y - return_y
-            self.deviation.append(dev)
-
-            # Y is over-valued by a factor
-            if return_y >= self.multiplier * pred_return_y:
-                if return_y > 0:  # and (
-                    # row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 0
-                    # ):
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.sell(row)
-                else:
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.sell(row)
-
-            # Y is undervalued by a factor
-            elif return_y < self.multiplier * pred_return_y:
-                if return_y > 0:  # and (
-                    # row["state_3"] == 0 or row["state_20"] == 0 or row["state_200"] == 1
-                    # ):
-                    if return_x > 0:
-                        self.buy(row, sizing=False)
-                    else:
-                        self.hold(row)
-                else:
-                    if return_x > 0:
-                        self.buy(row, sizing=False)
-                    else:
-                        self.buy(row, sizing=False)
-
-        else:
-            self.hold(row)
-        self.calculate_equity(row)
-
-
-class GSP_NSH(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        first_trading_day, today, days_in_month, days_past = self.get_key_dates(row)
-        if days_past > 0:
-            return_x = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[0]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[0]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            return_y = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[1]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[1]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            monthly_return_x = super().resample_returns(
-                returns=return_x, n=days_in_month - 1
-            )
-            pred_monthly_return_y = self.func(monthly_return_x, *self.popt)
-
-            pred_return_y = super().resample_returns(
-                returns=pred_monthly_return_y, m=days_in_month - 1
-            )
-            dev = pred_return_y - return_y
-            self.deviation.append(dev)
-
-            # Y is over-valued by a factor
-            if return_y >= self.multiplier * pred_return_y:
-                if return_y > 0:  # and (
-                    # row["state_3"] == 0 or ["state_5"] == 1 or row["state_200"] == 0
-                    # ):
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.sell(row)
-                else:
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.sell(row)
-
-            # Y is undervalued by a factor
-            elif return_y < self.multiplier * pred_return_y:
-                if return_y > 0:  # and (
-                    # row["state_3"] == 0 or row["state_20"] == 0 or row["state_200"] == 1
-                    # ):
-                    if return_x > 0:
-                        self.buy(row, sizing=False)
-                    else:
-                        self.hold(row)
-                else:
-                    if return_x > 0:
-                        self.buy(row, sizing=False)
-                    else:
-                        self.buy(row, sizing=False)
-
-        else:
-            self.hold(row)
-        self.calculate_equity(row)
-
-
-class TNI_ITQ(CorrelatedPairStrategy):
-    def trade(self, row: pd.Series) -> None:
-        first_trading_day, today, days_in_month, days_past = self.get_key_dates(row)
-        if days_past > 0:
-            return_x = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[0]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[0]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            return_y = super().resample_returns(
-                returns=self.df.loc[today, f"{self.pair[1]}_close"]
-                / self.df.loc[first_trading_day, f"{self.pair[1]}_close"]
-                - 1,
-                m=days_past,
-            )
-
-            monthly_return_x = super().resample_returns(
-                returns=return_x, n=days_in_month - 1
-            )
-            pred_monthly_return_y = self.func(monthly_return_x, *self.popt)
-
-            pred_return_y = super().resample_returns(
-                returns=pred_monthly_return_y, m=days_in_month - 1
-            )
-            dev = pred_return_y - return_y
-            self.deviation.append(dev)
-
-            # Y is over-valued by a factor
-            if return_y >= self.multiplier * pred_return_y:
-                if return_y > 0:  # and (
-                    # row["state_3"] == 0 or row["state_5"] == 0 or row["state_200"] == 1
-                    # ):
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.sell(row)
-                else:
-                    if return_x > 0:
-                        self.hold(row)
-                    else:
-                        self.sell(row)
-
-            # Y is undervalued by a factor
-            elif return_y < self.multiplier * pred_return_y:
-                if return_y > 0:  # and (
-                    # row["state_3"] == 0 or row["state_20"] == 1 or row["state_200"] == 0
-                    # ):
-                    if return_x > 0:
-                        self.buy(row, sizing=False)
-                    else:
-                        self.hold(row)
-                else:
-                    if return_x > 0:
-                        self.buy(row, sizing=False)
-                    else:
-                        self.buy(row, sizing=False)
-
-        else:
-            self.hold(row)
-        self.calculate_equity(row)
+def fit_weekly_returns(pair: List, degree: int) -> Tuple:
+    """
+    Fit target weekly returns against predictor weekly returns.
+    """
+    hp = HistoricalPrice()
+    weekly_returns = hp.get_returns(freq="weekly", tickers=pair)
+    x, y = (
+        weekly_returns.loc[:, pair]
+        .sort_values(by=[pair[0]], ascending=True)
+        .dropna()
+        .values
+    ).T
+    backtest = Backtest(degree=degree)
+    popt = backtest.fit_func(x, y, degree)
+    return backtest.func, popt
 
 
 def get_prices(pair: List) -> pd.DataFrame:
@@ -1163,23 +161,68 @@ def get_prices(pair: List) -> pd.DataFrame:
     return prices.iloc[500:]
 
 
-def get_states(pair: List) -> pd.DataFrame:
+def get_states(pair: List, online: bool = False) -> pd.DataFrame:
     """
     Get states based on target ticker.
+    Online states are forward filtered with the latest model, for live trading.
+    Otherwise they come from the batch state table when it is up to date.
     """
     hp = HistoricalPrice()
     price = hp.get_asset_price(pair[1], "daily")
-
-    for lag in [3, 5, 20, 200]:
-        clustered_df = cluster(pair[1], lag)
-        price[f"state_{lag}"] = clustered_df["state"]
+    table = None if online else read_states(tickers=[pair[1]])
+    last_date = price["close"].dropna().index[-1]
+
+    for lag in LAGS:
+        states = None
+        if table is not None and (pair[1], lag) in table.index.droplevel("date"):
+            states = table.xs((pair[1], lag), level=["ticker", "lag"])["state"]
+            states = states if states.index[-1] >= last_date else None
+        if states is None:
+            clustered_df = (
+                online_cluster(pair[1], lag) if online else cluster(pair[1], lag)
+            )
+            states = clustered_df["state"]
+        price[f"state_{lag}"] = states
     return price.loc[:, [c for c in price.columns if "state" in c]]
 
 
+def load_pair(pair: List, online: bool = False) -> pd.DataFrame:
+    prices = get_prices(pair)
+    states = get_states(pair, online)
+    return pd.merge(states, prices, right_index=True, left_index=True)
+
+
+def add_week(prices: pd.DataFrame) -> pd.DataFrame:
+    prices["date"] = prices.index
+    prices["week"] = prices.index.isocalendar().week.values.astype(np.int64)
+    return prices
+
+
+def period_to_date(prices: pd.DataFrame, pair: List[str], period: str) -> pd.DataFrame:
+    """
+    Period-open prices of both legs and trading days past since, in one pass.
+    A week opens at its first day's open (so that day counts as 1 day past),
+    a month at its first trading day's close (0 days past).
+    A new period starts whenever the week number or the month changes.
+    """
+    if period == "weekly":
+        key, price, offset = prices["week"].values, "open", 1
+    else:
+        key, price, offset = prices.index.to_period("M").asi8, "close", 0
+
+    n = len(prices)
+    new_period = np.r_[True, key[1:] != key[:-1]] if n else np.array([], dtype=bool)
+    first = np.maximum.accumulate(np.where(new_period, np.arange(n), 0))
+
+    returns = pd.DataFrame(index=prices.index)
+    for p in pair:
+        returns[f"{p}_period_open"] = prices[f"{p}_{price}"].values[first]
+    returns["days_past"] = np.arange(n) - first + offset
+    return returns
+
+
 def main():
-    prices = get_prices(args.pair)
-    states = get_states(args.pair)
-    prices = pd.merge(states, prices, right_index=True, left_index=True)
+    prices = load_pair(args.pair, online=not args.backtest)
     if not args.backtest:
         try:
             ticker_class = Ticker()
@@ -1196,14 +239,8 @@ def main():
             slack.send_message(message)
             return
 
-    prices["date"] = prices.index
-    prices["week"] = prices.apply(lambda row: row["date"].isocalendar()[1], axis=1)
-    if "_".join(args.pair) in globals():
-        class_object = globals()["_".join(args.pair)]
-    else:
-        class_object = globals()["test"]
-    c = class_object(**vars(args))
-    c.execute(prices)
+    prices = add_week(prices)
+    CorrelatedPairStrategy(**vars(args)).execute(prices)
 
 
 # MONTHLY, require average annual = 35% to trade
@@ -1283,6 +320,9 @@ if __name__ == "__main__":
     parser.add_argument("--backtest", action="store_true")
     parser.add_argument("--initial_capital", type=float, required=True)
     parser.add_argument("--manual_price", action="store_true")
+    parser.add_argument(
+        "--engine", choices=["loop", "vectorized"], default="vectorized"
+    )
     parser.add_argument(
         "--degree",
         type=int,
@@ -0,0 +1,90 @@
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.backtest.ledger import BUY, HOLD, SELL
+from app.utils import get_current_dir
+
+CURRENT_DIR = get_current_dir()
+RULES = f"{CURRENT_DIR}/rules.json"
+
+# Rule table action -> (action code, buy with position sizing)
+ACTIONS = {
+    "HOLD": (HOLD, False),
+    "BUY": (BUY, False),
+    "BUY_SIZED": (BUY, True),
+    "SELL": (SELL, False),
+}
+PERIODS = ["weekly", "monthly"]
+
+# Each pair in rules.json maps to a rule table:
+# - period: "weekly" or "monthly" period-to-date returns
+# - over: Y is over-valued by a factor, return_y >= multiplier * pred_return_y
+# - under: Y is undervalued by a factor, return_y < multiplier * pred_return_y
+# Within each side, "when" holds if return_y > 0 and any of the listed states
+# match (return_y > 0 alone if empty). "then" applies when it holds, "else"
+# otherwise, both as [action if return_x > 0, action if return_x <= 0].
+
+
+def load_rules(path: str = RULES) -> Dict[str, Dict]:
+    with open(path) as f:
+        rules = json.load(f)
+    for name, table in rules.items():
+        validate(name, table)
+    return rules
+
+
+def validate(name: str, table: Dict) -> None:
+    if table.get("period") not in PERIODS:
+        raise ValueError(f"{name}: period must be one of {PERIODS}")
+    for side in ["over", "under"]:
+        for branch in ["then", "else"]:
+            actions = table[side][branch]
+            if len(actions) != 2 or any(a not in ACTIONS for a in actions):
+                raise ValueError(
+                    f"{name}: {side}.{branch} must be 2 of {list(ACTIONS)}, got {actions}"
+                )
+
+
+def get_rules(pair: List[str], rules: Dict[str, Dict] = None) -> Dict:
+    """
+    Rule table of a pair, otherwise the default one.
+    """
+    rules = rules or load_rules()
+    return rules.get("_".join(pair), rules["default"])
+
+
+def compile_rules(
+    table: Dict, df: pd.DataFrame, multiplier: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluate a rule table over the whole frame at once.
+    Returns one action code and one sizing flag per row. Rows where neither side
+    applies (undefined returns, e.g. the first trading day of a month) are HOLD.
+    """
+    return_x = df["return_x"].values
+    return_y = df["return_y"].values
+    threshold = multiplier * df["pred_return_y"].values
+    x_up = return_x > 0
+
+    conditions, choices = [], []
+    sides = {"over": return_y >= threshold, "under": return_y < threshold}
+    for side, valued in sides.items():
+        when = return_y > 0
+        if table[side]["when"]:
+            when = when & np.logical_or.reduce(
+                [
+                    df[state].values == value
+                    for state, value in table[side]["when"].items()
+                ]
+            )
+        for branch, mask in [("then", when), ("else", ~when)]:
+            for action, leaf in zip(table[side][branch], [x_up, ~x_up]):
+                conditions.append(valued & mask & leaf)
+                choices.append(ACTIONS[action])
+
+    actions = np.select(conditions, [code for code, _ in choices], HOLD)
+    sized = np.select(conditions, [sized for _, sized in choices], False)
+    return actions, sized
@@ -0,0 +1,108 @@
+import argparse
+import itertools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import pandas as pd
+
+from app.backtest.correlated_pair.correlated_pair import (
+    CorrelatedPairStrategy,
+    add_week,
+    fit_weekly_returns,
+    load_pair,
+)
+from app.backtest.correlated_pair.rules import get_rules
+from app.utils import get_current_dir
+
+warnings.filterwarnings("ignore")
+CURRENT_DIR = get_current_dir()
+
+# WEEKLY
+GRID = {
+    "multiplier": [5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15],
+    "max_dev": [0.05, 0.1, 0.15, 0.2],
+    "max_portion": [0.1],
+    "degree": [1, 2],
+}
+
+# MONTHLY
+# "multiplier": [2, 2.5, 3.5, 4, 4.5, 5.5, 6, 6.5, 7]
+# "max_dev": [0.01, 0.02, 0.03, 0.04]
+
+# Shared with pool workers, set once per worker by the initializer
+PRICES = None
+FITS = None
+RULES = None
+
+
+def init_worker(prices: pd.DataFrame, fits: Dict, rules: Dict) -> None:
+    global PRICES, FITS, RULES
+    PRICES, FITS, RULES = prices, fits, rules
+
+
+def evaluate(params: Dict) -> Dict:
+    strategy = CorrelatedPairStrategy(
+        **params, backtest=True, sweep=True, fit=FITS[params["degree"]], rules=RULES
+    )
+    strategy.execute(PRICES.copy())
+    result = {k: v for k, v in params.items() if k != "pair"}
+    result["total_returns"] = strategy.total_returns
+    result["annualized_returns"] = strategy.annualized_returns
+    return result
+
+
+def sweep(
+    pair: List[str],
+    grid: Dict[str, List] = GRID,
+    initial_capital: float = 3000000,
+    workers: int = None,
+) -> pd.DataFrame:
+    """
+    Backtest every parameter combination of a pair in-process.
+    Prices, states, the rule table and the weekly returns fit (per degree)
+    are loaded once, then the grid is spread over a process pool.
+    Returns the results ranked by annualized returns.
+    """
+    prices = add_week(load_pair(pair))
+    fits = {degree: fit_weekly_returns(pair, degree) for degree in grid["degree"]}
+    rules = get_rules(pair)
+
+    params = [
+        {"pair": pair, "initial_capital": initial_capital, **dict(zip(grid, values))}
+        for values in itertools.product(*grid.values())
+    ]
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(prices, fits, rules)
+    ) as executor:
+        results = list(executor.map(evaluate, params))
+
+    results = (
+        pd.DataFrame(results)
+        .sort_values(by=["annualized_returns"], ascending=False)
+        .reset_index(drop=True)
+    )
+    results.to_csv(f"{CURRENT_DIR}/{'_'.join(pair)}_sweep.csv", index=False)
+    return results
+
+
+# python3 -m app.backtest.correlated_pair.sweep --pair DIG VCG
+# python3 -m app.backtest.correlated_pair.sweep --pair PLP DRH --multiplier 2 2.5 3.5 4 --max_dev 0.01 0.02
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pair", nargs="+", default=[], required=True)
+    parser.add_argument("--multiplier", nargs="+", type=float)
+    parser.add_argument("--max_dev", nargs="+", type=float)
+    parser.add_argument("--max_portion", nargs="+", type=float)
+    parser.add_argument("--degree", nargs="+", type=int)
+    parser.add_argument("--initial_capital", type=float, default=3000000)
+    parser.add_argument("--workers", type=int, default=None)
+
+    args = parser.parse_args()
+    grid = {key: getattr(args, key) or values for key, values in GRID.items()}
+    results = sweep(args.pair, grid, args.initial_capital, args.workers)
+    print(results.head(10).to_string())
+    print(
+        f"Maximum Annualized Returns for {' '.join(args.pair)}: "
+        f"{results['annualized_returns'].iloc[0]:.4f}"
+    )
@@ -1,10 +1,13 @@
 import argparse
 import warnings
+from typing import Tuple
 
+import numpy as np
 import pandas as pd
 
 from app import slack
 from app.backtest.backtest import Backtest
+from app.backtest.ledger import BUY, HOLD, SELL, RowView
 from app.historical_price import HistoricalPrice
 from app.scrapers.vndirect import Ticker
 from app.utils import get_current_dir
@@ -15,6 +18,10 @@ CURRENT_DIR = get_current_dir()
 
 
 class FinancialRatiosStrategy(Backtest):
+    vectorizable = True
+    # (func, popt) of the prediction fit, can be passed in precomputed
+    fit = None
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.LOG_NAME = f"financial_ratios_backtest_{self.ticker}"
@@ -26,15 +33,14 @@ class FinancialRatiosStrategy(Backtest):
 
     def preprocess(self) -> None:
         if self.degree != 0:
-            xy = self.df.loc[:, ["pred", "target"]].dropna()
-            x = xy["pred"].values
-            y = xy["target"].values
-            popt = self.fit_func(x, y, self.degree)
+            if self.fit is None:
+                self.fit = fit_pred(self.df, self.degree)
+            self.func, popt = self.fit
 
             self.df["pred"] = self.func(self.df["pred"].values, *popt)
         return
 
-    def trade(self, row: pd.Series) -> None:
+    def trade(self, row: RowView) -> None:
         if row["pred"] > (1 + self.multiplier) * row["close"]:
             self.buy(row)
         elif row["pred"] < (1 - self.multiplier) * row["close"]:
@@ -44,12 +50,42 @@ class FinancialRatiosStrategy(Backtest):
 
         self.calculate_equity(row)
 
-
-def get_ticker_pred(ticker: str) -> pd.DataFrame:
-    path = f"app/models/financial_ratios/financial_ratios_model_pred_{args.industry.replace(' ','_').lower()}.csv"
+    def signals(self) -> Tuple[np.ndarray, np.ndarray]:
+        pred = self.df["pred"].values
+        close = self.df["close"].values.astype(np.float64)
+        actions = np.select(
+            [
+                pred > (1 + self.multiplier) * close,
+                pred < (1 - self.multiplier) * close,
+            ],
+            [BUY, SELL],
+            HOLD,
+        )
+        sizes = np.where(actions == BUY, self.position_sizing(), 1)
+        return actions, sizes
+
+
+def fit_pred(df: pd.DataFrame, degree: int) -> Tuple:
+    """
+    Reduce prediction noise by fitting a polynomial of the targets on the predictions.
+    """
+    xy = df.loc[:, ["pred", "target"]].dropna()
+    x = xy["pred"].values
+    y = xy["target"].values
+    backtest = Backtest(degree=degree)
+    popt = backtest.fit_func(x, y, degree)
+    return backtest.func, popt
+
+
+def read_pred(industry: str) -> pd.DataFrame:
+    path = f"app/models/financial_ratios/financial_ratios_model_pred_{industry.replace(' ','_').lower()}.csv"
     df = pd.read_csv(path)
     df = df.set_index("date")
-    df = df.loc[df["ticker"] == ticker, ["pred", "target"]]
+    return df
+
+
+def get_ticker_pred(ticker: str, pred: pd.DataFrame) -> pd.DataFrame:
+    df = pred.loc[pred["ticker"] == ticker, ["pred", "target"]]
     df.index = pd.to_datetime(df.index).to_period("Q") + 1
     return df
 
@@ -62,10 +98,14 @@ def get_daily_close(ticker: str) -> pd.DataFrame:
     return price.iloc[250:]
 
 
+def load_ticker(ticker: str, pred: pd.DataFrame) -> pd.DataFrame:
+    df = get_ticker_pred(ticker, pred)
+    price = get_daily_close(ticker)
+    return price.merge(df, left_on="quarter", right_index=True, how="outer")
+
+
 def main():
-    df = get_ticker_pred(args.ticker)
-    price = get_daily_close(args.ticker)
-    price = price.merge(df, left_on="quarter", right_index=True, how="outer")
+    price = load_ticker(args.ticker, read_pred(args.industry))
     if not args.backtest:
         try:
             ticker_class = Ticker()
@@ -101,6 +141,7 @@ if __name__ == "__main__":
     parser.add_argument("--max_portion", type=float, required=True)
     parser.add_argument("--backtest", action="store_true")
     parser.add_argument("--industry", required=True, type=str)
+    parser.add_argument("--engine", choices=["loop", "vectorized"], default="loop")
     parser.add_argument(
         "--degree",
         type=int,
@@ -0,0 +1,136 @@
+import argparse
+import itertools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from app.backtest.financial_ratios.financial_ratios import (
+    FinancialRatiosStrategy,
+    fit_pred,
+    load_ticker,
+    read_pred,
+)
+from app.utils import get_current_dir
+
+warnings.filterwarnings("ignore")
+CURRENT_DIR = get_current_dir()
+
+GRID = {
+    "multiplier": np.round(np.arange(0, 0.21, 0.01), 2).tolist(),
+    "degree": [1, 2],
+    "max_portion": [0.2, 1.0],
+}
+
+# Shared with pool workers, set once per worker by the initializer
+PRICES = None
+FITS = None
+
+
+def init_worker(prices: Dict[str, pd.DataFrame], fits: Dict) -> None:
+    global PRICES, FITS
+    PRICES, FITS = prices, fits
+
+
+def evaluate(params: Dict) -> Dict:
+    ticker, degree = params["ticker"], params["degree"]
+    strategy = FinancialRatiosStrategy(
+        **params,
+        backtest=True,
+        sweep=True,
+        engine="vectorized",
+        fit=FITS.get((ticker, degree)),
+    )
+    strategy.execute(PRICES[ticker].copy())
+    result = dict(params)
+    result["total_returns"] = strategy.total_returns
+    result["annualized_returns"] = strategy.annualized_returns
+    return result
+
+
+def sweep(
+    industry: str,
+    tickers: List[str] = [],
+    grid: Dict[str, List] = GRID,
+    initial_capital: float = 3000000,
+    workers: int = None,
+) -> pd.DataFrame:
+    """
+    Backtest every parameter combination for each ticker of an industry.
+    Predictions and prices are loaded once and the prediction fit is computed
+    once per (ticker, degree), then all combinations run on a process pool.
+    Returns all results ranked by annualized returns within each ticker.
+    """
+    pred = read_pred(industry)
+    if not tickers:
+        tickers = pred["ticker"].unique().tolist()
+
+    prices, fits = {}, {}
+    for ticker in tickers:
+        try:
+            prices[ticker] = load_ticker(ticker, pred).dropna(subset=["target"])
+            for degree in grid["degree"]:
+                if degree != 0:
+                    fits[(ticker, degree)] = fit_pred(prices[ticker], degree)
+        except Exception:
+            print(f"Failed to load {ticker}")
+            prices.pop(ticker, None)
+            continue
+
+    params = [
+        {
+            "ticker": ticker,
+            "industry": industry,
+            "initial_capital": initial_capital,
+            **dict(zip(grid, values)),
+        }
+        for ticker in prices
+        for values in itertools.product(*grid.values())
+    ]
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(prices, fits)
+    ) as executor:
+        results = list(executor.map(evaluate, params, chunksize=16))
+
+    results = (
+        pd.DataFrame(results)
+        .sort_values(by=["ticker", "annualized_returns"], ascending=[True, False])
+        .reset_index(drop=True)
+    )
+    name = industry.replace(" ", "_").lower()
+    results.to_csv(f"{CURRENT_DIR}/{name}_sweep.csv", index=False)
+    return results
+
+
+def best(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Best configuration per ticker.
+    """
+    return (
+        results.groupby("ticker", sort=False)
+        .head(1)
+        .sort_values(by=["annualized_returns"], ascending=False)
+        .set_index("ticker")
+    )
+
+
+# python3 -m app.backtest.financial_ratios.sweep --industry "Food & Beverage" --tickers BAF
+# python3 -m app.backtest.financial_ratios.sweep --industry "Health Care" --workers 8
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--industry", required=True, type=str)
+    parser.add_argument("--tickers", nargs="+", default=[])
+    parser.add_argument("--multiplier", nargs="+", type=float)
+    parser.add_argument("--degree", nargs="+", type=int)
+    parser.add_argument("--max_portion", nargs="+", type=float)
+    parser.add_argument("--initial_capital", type=float, default=3000000)
+    parser.add_argument("--workers", type=int, default=None)
+
+    args = parser.parse_args()
+    grid = {key: getattr(args, key) or values for key, values in GRID.items()}
+    results = sweep(
+        args.industry, args.tickers, grid, args.initial_capital, args.workers
+    )
+    print(best(results).to_string())
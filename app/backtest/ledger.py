@@ -0,0 +1,50 @@
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+# Action codes, shared by the row-by-row and vectorized engines
+HOLD, BUY, SELL = 0, 1, -1
+ACTIONS = {HOLD: "HOLD", BUY: "BUY", SELL: "SELL"}
+
+
+class Ledger:
+    """
+    Per-row bookkeeping of a backtest in preallocated arrays, indexed by
+    integer position. Materialized into the results DataFrame once.
+    """
+
+    __slots__ = (
+        "action",
+        "sizing",
+        "shares_buyable",
+        "shares_sellable",
+        "fees",
+        "equity",
+    )
+
+    def __init__(self, n: int):
+        for column in self.__slots__:
+            setattr(self, column, np.full(n, np.nan))
+
+    def materialize(self, df: pd.DataFrame) -> pd.DataFrame:
+        columns = {column: getattr(self, column) for column in self.__slots__}
+        columns["action"] = pd.Series(self.action).map(ACTIONS).values
+        return df.assign(**columns)
+
+
+class RowView:
+    """
+    Lightweight view of one row of the backtest frame, supporting row["col"]
+    and row.name like the df.iloc[i] Series it replaces, without building one.
+    """
+
+    __slots__ = ("position", "name", "columns")
+
+    def __init__(self, position: int, name: Any, columns: Dict[str, np.ndarray]):
+        self.position = position
+        self.name = name
+        self.columns = columns
+
+    def __getitem__(self, column: str) -> Any:
+        return self.columns[column][self.position]
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def sizeof(value: Any) -> int:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    return 0
+
+
+def freeze(value: Any) -> Any:
+    """
+    Make the arrays of a frame read-only. Shallow copies of it can still add
+    or replace columns, but writing into the shared values raises.
+    """
+    if isinstance(value, pd.DataFrame):
+        arrays = value._mgr.arrays
+    elif isinstance(value, pd.Series):
+        arrays = [value._values]
+    else:
+        return value
+    for array in arrays:
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+    return value
+
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by a memory budget (bytes).
+    Keys are tuples whose first element is the ticker, so all entries
+    of a ticker can be invalidated at once.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024**2):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if key not in self.data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if key in self.data:
+            self.pop(key)
+        nbytes = sizeof(value)
+        if nbytes > self.max_bytes:
+            return
+        self.data[key] = value
+        self.sizes[key] = nbytes
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self.pop(next(iter(self.data)))
+
+    def pop(self, key: Hashable) -> None:
+        self.data.pop(key)
+        self.nbytes -= self.sizes.pop(key)
+
+    def invalidate(self, ticker: str) -> None:
+        for key in [k for k in self.data if k[0] == ticker]:
+            self.pop(key)
+
+    def clear(self) -> None:
+        self.data.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+
+    def info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.data),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,398 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+METHODS = {"kendall": stats.kendalltau, "spearman": stats.spearmanr}
+
+# Rank matrices shared with pool workers, set once per worker by the initializer
+X_RANKS = None
+Y_RANKS = None
+
+
+def init_worker(x_ranks: np.ndarray, y_ranks: np.ndarray) -> None:
+    global X_RANKS, Y_RANKS
+    X_RANKS, Y_RANKS = x_ranks, y_ranks
+
+
+def correlate_pairs(
+    pairs: List[Tuple[int, int]],
+    min_sample: int,
+    lag: int = 0,
+    methods: Tuple[str] = ("kendall",),
+) -> np.ndarray:
+    """
+    Correlation and p-value of each (i, j) column pair, X column i lagged by
+    'lag' rows against Y column j, on the rows where both are observed.
+    scipy's kendalltau is O(n log n) per pair.
+    """
+    n = len(X_RANKS)
+    x, y = X_RANKS[: n - lag], Y_RANKS[lag:]
+    x_valid, y_valid = ~np.isnan(x), ~np.isnan(y)
+
+    out = np.full((len(pairs), 2 * len(methods)), np.nan)
+    for k, (i, j) in enumerate(pairs):
+        mask = x_valid[:, i] & y_valid[:, j]
+        if mask.sum() >= min_sample:
+            for m, method in enumerate(methods):
+                corr, p_value = METHODS[method](x[mask, i], y[mask, j])
+                out[k, 2 * m : 2 * m + 2] = corr, p_value
+    return out
+
+
+def rank(df: pd.DataFrame) -> np.ndarray:
+    """
+    Rank correlations only depend on orderings, so every column is ranked once
+    and all pairs (and lags) work on the ranks.
+    """
+    return np.ascontiguousarray(df.rank(method="dense").values, dtype=np.float64)
+
+
+def chunk(pairs: List[Tuple[int, int]], size: int) -> List[List[Tuple[int, int]]]:
+    return [pairs[i : i + size] for i in range(0, len(pairs), size)]
+
+
+def run_tasks(
+    tasks: List[Tuple], x_ranks: np.ndarray, y_ranks: np.ndarray, workers: int
+) -> List[np.ndarray]:
+    """
+    Evaluate correlate_pairs(*task) for every task, on a process pool that is
+    initialized once with the rank matrices.
+    """
+    if workers == 1 or len(tasks) <= 1:
+        init_worker(x_ranks, y_ranks)
+        return [correlate_pairs(*task) for task in tasks]
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(x_ranks, y_ranks)
+    ) as executor:
+        return list(executor.map(correlate_pairs, *zip(*tasks)))
+
+
+class KendallCorrelation:
+    """
+    All-pairs Kendall correlation between the columns of two returns panels.
+    With a single panel, the matrix is symmetric and each pair is computed once.
+    """
+
+    def __init__(self, min_sample: int, workers: int = None, chunk_size: int = 2000):
+        self.min_sample = min_sample
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    def compute(
+        self, df1: pd.DataFrame, df2: pd.DataFrame = None
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Returns (tau, p_value) matrices indexed by df1 columns x df2 columns.
+        Pairs with fewer than min_sample joint observations are NaN.
+        """
+        symmetric = df2 is None or df2 is df1
+        if symmetric:
+            df2 = df1
+        else:
+            df1, df2 = df1.align(df2, join="outer", axis=0)
+
+        x_ranks = rank(df1)
+        y_ranks = x_ranks if symmetric else rank(df2)
+
+        n1, n2 = df1.shape[1], df2.shape[1]
+        if symmetric:
+            rows, cols = np.triu_indices(n1, k=1)
+        else:
+            rows, cols = np.divmod(np.arange(n1 * n2), n2)
+        pairs = list(zip(rows.tolist(), cols.tolist()))
+        tasks = [(c, self.min_sample) for c in chunk(pairs, self.chunk_size)]
+        results = run_tasks(tasks, x_ranks, y_ranks, self.workers)
+        results = np.concatenate(results) if results else np.empty((0, 2))
+
+        tau = np.full((n1, n2), np.nan)
+        p_value = np.full((n1, n2), np.nan)
+        tau[rows, cols], p_value[rows, cols] = results[:, 0], results[:, 1]
+        if symmetric:
+            tau[cols, rows], p_value[cols, rows] = results[:, 0], results[:, 1]
+
+        return (
+            pd.DataFrame(tau, index=df1.columns, columns=df2.columns),
+            pd.DataFrame(p_value, index=df1.columns, columns=df2.columns),
+        )
+
+    @staticmethod
+    def to_long(tau: pd.DataFrame, p_value: pd.DataFrame) -> pd.DataFrame:
+        """
+        Long-form table indexed by '{r1}_{r2}', as read by the correlation notebook.
+        """
+        r1, r2 = np.meshgrid(tau.index, tau.columns, indexing="ij")
+        keep = ~np.isnan(tau.values) & (r1 != r2)
+        return pd.DataFrame(
+            {"kendall": tau.values[keep], "p_value": p_value.values[keep]},
+            index=[f"{a}_{b}" for a, b in zip(r1[keep], r2[keep])],
+        )
+
+    @staticmethod
+    def to_dict(tau: pd.DataFrame, p_value: pd.DataFrame) -> Dict[str, List[float]]:
+        long = KendallCorrelation.to_long(tau, p_value)
+        return dict(zip(long.index, long.values.tolist()))
+
+    @staticmethod
+    def save(tau: pd.DataFrame, p_value: pd.DataFrame, path: str) -> None:
+        """
+        Compact matrix format (.npz) next to the long-form CSV.
+        """
+        np.savez_compressed(
+            f"{path}.npz",
+            index=tau.index.values.astype(str),
+            columns=tau.columns.values.astype(str),
+            kendall=tau.values.astype(np.float32),
+            p_value=p_value.values,
+        )
+        KendallCorrelation.to_long(tau, p_value).to_csv(f"{path}.csv")
+
+    @staticmethod
+    def load(path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        data = np.load(f"{path}.npz")
+        index, columns = data["index"], data["columns"]
+        return (
+            pd.DataFrame(data["kendall"], index=index, columns=columns),
+            pd.DataFrame(data["p_value"], index=index, columns=columns),
+        )
+
+
+class LaggedCorrelationScan:
+    """
+    Lagged rank correlations of every (predictor, target) pair of a returns panel:
+    predictor returns at t - lag against target returns at t.
+    The panel is ranked once and the same rank matrix serves every lag and method.
+    """
+
+    def __init__(
+        self,
+        lags: List[int] = [0, 1, 2],
+        methods: List[str] = ["kendall", "spearman"],
+        workers: int = None,
+        chunk_size: int = 2000,
+    ):
+        self.lags = lags
+        self.methods = tuple(methods)
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    def columns(self) -> List[str]:
+        return [c for m in self.methods for c in (m, f"{m}_p_value")]
+
+    def scan(self, returns: pd.DataFrame, min_sample: int) -> pd.DataFrame:
+        """
+        Long table with one row per (lag, predictor, target).
+        Lag 0 is symmetric, so each unordered pair is computed once and mirrored.
+        """
+        ranks = rank(returns)
+        n = returns.shape[1]
+        pairs = {}
+        for lag in self.lags:
+            if lag == 0:
+                rows, cols = np.triu_indices(n, k=1)
+            else:
+                rows, cols = np.nonzero(~np.eye(n, dtype=bool))
+            pairs[lag] = (rows, cols)
+
+        tasks = [
+            (c, min_sample, lag, self.methods)
+            for lag, (rows, cols) in pairs.items()
+            for c in chunk(list(zip(rows.tolist(), cols.tolist())), self.chunk_size)
+        ]
+        results = iter(run_tasks(tasks, ranks, ranks, self.workers))
+
+        tickers = np.asarray(returns.columns)
+        tables = []
+        for lag, (rows, cols) in pairs.items():
+            n_chunks = -(-len(rows) // self.chunk_size)
+            values = [next(results) for _ in range(n_chunks)]
+            values = (
+                np.concatenate(values)
+                if values
+                else np.empty((0, 2 * len(self.methods)))
+            )
+            if lag == 0:
+                rows, cols = np.concatenate([rows, cols]), np.concatenate([cols, rows])
+                values = np.concatenate([values, values])
+
+            table = pd.DataFrame(values, columns=self.columns())
+            table.insert(0, "target", tickers[cols])
+            table.insert(0, "predictor", tickers[rows])
+            table.insert(0, "lag", lag)
+            tables.append(table.dropna(subset=self.columns(), how="all"))
+
+        if not tables:
+            return pd.DataFrame(columns=["lag", "predictor", "target"] + self.columns())
+        return pd.concat(tables, ignore_index=True)
+
+
+class IncrementalCorrelation:
+    """
+    Sufficient statistics of every pair, updated one observation at a time:
+    - Kendall: concordant minus discordant pairs, joint pairs and x-ties,
+      each folded in with one matrix product of the new row against the window.
+    - Pearson: pairwise running sums and co-moments.
+    Missing values contribute nothing, so pairs are handled pairwise.
+    With a rolling window the oldest row is expired with the same products.
+    New tickers are added by replaying the kept rows for their pairs only.
+    """
+
+    def __init__(self, tickers: List[str], window: int = None):
+        n = len(tickers)
+        self.tickers = list(tickers)
+        self.window = window
+        self.dates = []
+        self.history = np.empty((0, n))
+
+        self.concordance = np.zeros((n, n))
+        self.pairs = np.zeros((n, n))
+        self.ties = np.zeros((n, n))
+
+        self.n = np.zeros((n, n))
+        self.sum_x = np.zeros((n, n))
+        self.sum_xx = np.zeros((n, n))
+        self.sum_xy = np.zeros((n, n))
+
+    def fold(
+        self, row: np.ndarray, others: np.ndarray, weight: int, new: np.ndarray = None
+    ) -> None:
+        """
+        Add (weight=1) or remove (weight=-1) the contribution of one row,
+        to every pair or, given `new` column positions, to their pairs only.
+        """
+        valid = (~np.isnan(row)).astype(np.float64)[None, :]
+        x = np.nan_to_num(row)[None, :]
+
+        diff = row - others
+        both = (~np.isnan(diff)).astype(np.float64)
+        sign = np.nan_to_num(np.sign(diff))
+        tied = both * (sign == 0)
+
+        for stat, a, b in [
+            (self.n, valid, valid),
+            (self.sum_x, x, valid),
+            (self.sum_xx, x**2, valid),
+            (self.sum_xy, x, x),
+            (self.concordance, sign, sign),
+            (self.pairs, both, both),
+            (self.ties, tied, both),
+        ]:
+            if new is None:
+                stat += weight * (a.T @ b)
+            else:
+                old = np.setdiff1d(np.arange(stat.shape[1]), new)
+                stat[new, :] += weight * (a[:, new].T @ b)
+                stat[np.ix_(old, new)] += weight * (a[:, old].T @ b[:, new])
+
+    def extend(self, tickers: List[str], returns: pd.DataFrame) -> None:
+        """
+        Add tickers, with their returns on the kept dates taken from `returns`:
+        O(rows^2 x tickers x new tickers) instead of rebuilding every pair.
+        """
+        n, k = len(self.tickers), len(tickers)
+        values = returns.reindex(index=self.dates, columns=tickers).values
+        self.tickers += list(tickers)
+        self.history = np.hstack([self.history, values.astype(np.float64)])
+        for key in ["concordance", "pairs", "ties", "n", "sum_x", "sum_xx", "sum_xy"]:
+            setattr(self, key, np.pad(getattr(self, key), ((0, k), (0, k))))
+
+        new = np.arange(n, n + k)
+        for t in range(len(self.history)):
+            self.fold(self.history[t], self.history[:t], 1, new)
+
+    def update(self, returns: pd.DataFrame) -> None:
+        """
+        Fold in new rows (dates x tickers), expiring rows that leave the window.
+        """
+        values = returns.reindex(columns=self.tickers).values.astype(np.float64)
+        block = np.vstack([self.history, values])
+        start, end = 0, len(self.history)
+        for date, row in zip(returns.index, values):
+            self.fold(row, block[start:end], 1)
+            self.dates.append(date)
+            end += 1
+
+            if self.window is not None and end - start > self.window:
+                self.fold(block[start], block[start + 1 : end], -1)
+                self.dates.pop(0)
+                start += 1
+        self.history = block[start:]
+
+    def kendall(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.concordance / np.sqrt(
+                (self.pairs - self.ties) * (self.pairs - self.ties.T)
+            )
+
+    def kendall_p_value(self) -> np.ndarray:
+        """
+        Normal approximation without tie correction.
+        """
+        n = self.n
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = 3 * self.kendall() * np.sqrt(n * (n - 1)) / np.sqrt(2 * (2 * n + 5))
+        return 2 * stats.norm.sf(np.abs(z))
+
+    def pearson(self) -> np.ndarray:
+        n, sum_x, sum_y = self.n, self.sum_x, self.sum_x.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = self.sum_xy - sum_x * sum_y / n
+            var_x = self.sum_xx - sum_x**2 / n
+            var_y = self.sum_xx.T - sum_y**2 / n
+            return cov / np.sqrt(var_x * var_y)
+
+    def to_long(self, min_sample: int = 0) -> pd.DataFrame:
+        """
+        Long-form table indexed by '{r1}_{r2}', sorted by Kendall tau.
+        """
+        tickers = np.asarray(self.tickers)
+        r1, r2 = np.nonzero((self.n >= min_sample) & ~np.eye(len(tickers), dtype=bool))
+        table = pd.DataFrame(
+            {
+                "kendall": self.kendall()[r1, r2],
+                "p_value": self.kendall_p_value()[r1, r2],
+                "pearson": self.pearson()[r1, r2],
+                "n": self.n[r1, r2].astype(int),
+            },
+            index=[f"{a}_{b}" for a, b in zip(tickers[r1], tickers[r2])],
+        )
+        return table.sort_values(by=["kendall"], ascending=False)
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(
+            path,
+            tickers=np.asarray(self.tickers, dtype=str),
+            window=-1 if self.window is None else self.window,
+            dates=np.asarray(self.dates, dtype="datetime64[ns]"),
+            history=self.history,
+            concordance=self.concordance,
+            pairs=self.pairs,
+            ties=self.ties,
+            n=self.n,
+            sum_x=self.sum_x,
+            sum_xx=self.sum_xx,
+            sum_xy=self.sum_xy,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "IncrementalCorrelation":
+        data = np.load(path)
+        window = int(data["window"])
+        state = cls(data["tickers"].tolist(), None if window < 0 else window)
+        state.dates = list(pd.DatetimeIndex(data["dates"]))
+        for key in [
+            "history",
+            "concordance",
+            "pairs",
+            "ties",
+            "n",
+            "sum_x",
+            "sum_xx",
+            "sum_xy",
+        ]:
+            setattr(state, key, data[key])
+        return state
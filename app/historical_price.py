@@ -1,15 +1,29 @@
+import argparse
 import glob
+import os
 import re
 from sys import platform
 from typing import Dict, List
 
+import numpy as np
 import pandas as pd
-from scipy import stats
+
+from app.cache import LRUCache, freeze
+from app.correlation import (
+    IncrementalCorrelation,
+    KendallCorrelation,
+    LaggedCorrelationScan,
+)
+from app.price_store import PriceStore
 
 pd.set_option("display.max_rows", None)
 
 
 class HistoricalPrice:
+    # Shared by every instance, so repeated reads within a process are parsed once
+    STORE = PriceStore()
+    CACHE = LRUCache(max_bytes=int(os.environ.get("PRICE_CACHE_MB", 512)) * 1024**2)
+
     # Minimum 4 years data total
     FREQ = {
         "monthly": {"min_sample": 12 * 4, "resample": "M"},
@@ -19,6 +33,14 @@ class HistoricalPrice:
         "quarterly": {"min_sample": 4 * 4, "resample": "Q"},
     }
 
+    def __init__(self, cache_mb: int = None):
+        """
+        cache_mb gives this instance its own cache with that budget, instead of
+        the shared one (PRICE_CACHE_MB env var, 512 MB by default).
+        """
+        if cache_mb is not None:
+            self.CACHE = LRUCache(max_bytes=cache_mb * 1024**2)
+
     def path(self) -> str:
         if platform == "linux":
             return "data/*historical_price.csv"
@@ -47,7 +69,11 @@ class HistoricalPrice:
         return order
 
     def get_asset_price(self, ticker: str, freq: str) -> pd.DataFrame:
-        df = self.read(ticker)
+        return self.memoize(
+            ticker, "asset_price", freq, lambda: self.resample(self.read(ticker), freq)
+        )
+
+    def resample(self, df: pd.DataFrame, freq: str) -> pd.DataFrame:
         df = df.resample(self.FREQ[freq]["resample"], convention="end").agg(
             {
                 "low": "last",
@@ -63,47 +89,138 @@ class HistoricalPrice:
         )
         return df
 
+    def get_closes(self, tickers: List[str], freq: str) -> pd.DataFrame:
+        """
+        Closes of many tickers as one long (date, ticker) frame, assembled in a
+        single pass from each ticker's cached resampled prices.
+        """
+        series = {}
+        for ticker in tickers:
+            try:
+                series[ticker] = self.get_asset_price(ticker, freq)["close"]
+            except Exception:
+                continue
+
+        lengths = [len(s) for s in series.values()]
+        index = pd.MultiIndex.from_arrays(
+            [
+                pd.DatetimeIndex(
+                    np.concatenate([s.index.values for s in series.values()])
+                    if series
+                    else []
+                ),
+                np.repeat(np.array(list(series), dtype=object), lengths),
+            ],
+            names=["date", "ticker"],
+        )
+        close = (
+            np.concatenate([s.values for s in series.values()])
+            if series
+            else np.array([], dtype=np.float32)
+        )
+        return pd.DataFrame({"close": close}, index=index)
+
     def get_returns(self, freq: str, tickers: List[str] = []) -> pd.DataFrame:
+        return self.get_returns_panel(freq, tickers)
+
+    def get_all_returns(self, freq: str) -> pd.DataFrame:
+        return self.get_returns_panel(freq)
+
+    def get_returns_panel(self, freq: str, tickers: List[str] = []) -> pd.DataFrame:
+        """
+        Returns of all tickers as one (dates x tickers) frame.
+        Series are aligned once onto the union of their dates and written into a
+        single preallocated array; tickers below min_sample are masked out.
+        Columns keep the (reversed) order get_returns has always produced.
+        """
         self.min_sample = self.FREQ[freq]["min_sample"]
-        returns = None
 
         if not tickers:
             tickers = self.get_historical_prices().keys()
 
+        series = {}
         for ticker in tickers:
             try:
-                asset_returns = self.returns(ticker, freq)
-                temp_df = pd.DataFrame(
-                    data=asset_returns["r"].values,
-                    columns=[ticker],
-                    index=asset_returns.index,
-                )
-
-                if temp_df.notna().sum().values[0] >= self.min_sample:
-                    # ensure adequate sample size
-                    if returns is not None:
-                        returns = pd.concat([temp_df, returns], axis=1)
-                    else:
-                        returns = temp_df
+                series[ticker] = self.returns(ticker, freq)["r"]
             except Exception:
                 continue
+
+        index = pd.DatetimeIndex(
+            np.unique(np.concatenate([s.index.values for s in series.values()]))
+            if series
+            else [],
+            name="date",
+        )
+        values = np.full((len(index), len(series)), np.nan)
+        for j, s in enumerate(series.values()):
+            values[index.get_indexer(s.index), j] = s.values
+
+        # ensure adequate sample size
+        mask = (~np.isnan(values)).sum(axis=0) >= self.min_sample
+        columns = np.array(list(series.keys()), dtype=object)[mask][::-1]
+        values = np.ascontiguousarray(values[:, mask][:, ::-1])
+
+        returns = pd.DataFrame(data=values, columns=columns, index=index)
         return returns.resample(self.FREQ[freq]["resample"]).last().dropna(how="all")
 
-    def get_corr(self, df1: pd.DataFrame, df2: pd.DataFrame) -> dict:
-        corr = {}
-        for r1 in df1.columns:
-            for r2 in df2.columns:
-                if r1 != r2:
-                    temp = (
-                        pd.concat([df1[r1], df2[r2]], axis=1)
-                        .dropna()
-                        .sort_index(axis=1)
-                    )
-                    if len(temp) >= self.min_sample:
-                        tau, p_value = stats.kendalltau(temp[r1], temp[r2])
-                        if (r1 + "_" + r2) not in corr:
-                            corr[r1 + "_" + r2] = [tau, p_value]
-        return corr
+    def get_corr(self, df1: pd.DataFrame, df2: pd.DataFrame, workers: int = 1) -> dict:
+        engine = KendallCorrelation(self.min_sample, workers)
+        tau, p_value = engine.compute(df1, df2)
+        return engine.to_dict(tau, p_value)
+
+    def save_corr(self, freq: str, workers: int = None) -> None:
+        """
+        Full pairwise Kendall matrix of a frequency's returns panel,
+        written as data/{freq}_returns_kendall_correlation_lag0.{npz,csv}.
+        """
+        returns = self.get_returns_panel(freq)
+        engine = KendallCorrelation(self.min_sample, workers)
+        tau, p_value = engine.compute(returns)
+        engine.save(tau, p_value, f"data/{freq}_returns_kendall_correlation_lag0")
+
+    def scan_lagged_corr(
+        self,
+        freqs: List[str],
+        lags: List[int] = [0, 1, 2],
+        methods: List[str] = ["kendall", "spearman"],
+        workers: int = None,
+    ) -> pd.DataFrame:
+        """
+        Lagged Kendall/Spearman correlations of every (predictor, target) pair
+        for each frequency, consolidated into data/returns_lagged_correlation.csv.
+        """
+        engine = LaggedCorrelationScan(lags, methods, workers)
+        tables = []
+        for freq in freqs:
+            returns = self.get_returns_panel(freq)
+            table = engine.scan(returns, self.min_sample)
+            table.insert(0, "freq", freq)
+            tables.append(table)
+        result = pd.concat(tables, ignore_index=True)
+        result.to_csv("data/returns_lagged_correlation.csv", index=False)
+        return result
+
+    def update_corr(self, freq: str, window: int = None) -> pd.DataFrame:
+        """
+        Fold the returns added since the last run into the stored pairwise
+        correlation state. Tickers new to the state (e.g. a listing reaching
+        min_sample) are added to it, it is only rebuilt when the window changes.
+        """
+        returns = self.get_returns_panel(freq)
+        path = f"data/{freq}_returns_correlation_state.npz"
+
+        state = IncrementalCorrelation.load(path) if os.path.exists(path) else None
+        if state is None or state.window != window:
+            state = IncrementalCorrelation(sorted(returns.columns), window)
+        new = sorted(set(returns.columns) - set(state.tickers))
+        if new:
+            state.extend(new, returns)
+        if state.dates:
+            returns = returns.loc[returns.index > state.dates[-1]]
+
+        state.update(returns)
+        state.save(path)
+        return state.to_long(min(self.min_sample, window or self.min_sample))
 
     def preprocess(self, df: pd.DataFrame) -> pd.DataFrame:
         df.columns = [
@@ -126,13 +243,111 @@ class HistoricalPrice:
         df = df.sort_index(ascending=True)
         return df
 
+    def source(self, ticker: str) -> str:
+        return f"data/{ticker}_historical_price.csv"
+
+    def mtime(self, ticker: str) -> float:
+        if os.path.exists(self.source(ticker)):
+            return os.path.getmtime(self.source(ticker))
+        return self.STORE.mtime(ticker)
+
+    def memoize(self, ticker: str, kind: str, freq: str, loader) -> pd.DataFrame:
+        """
+        Cache keyed by (ticker, kind, freq, file mtime), so a rewritten CSV is a miss.
+        Cached frames are read-only and callers get a shallow copy: adding or
+        replacing columns is free, writing into cached values raises instead
+        of corrupting them, so copy first (e.g. df.copy()) to modify in place.
+        """
+        key = (ticker, kind, freq, self.mtime(ticker))
+        df = self.CACHE.get(key)
+        if df is None:
+            df = freeze(loader())
+            self.CACHE.put(key, df)
+        return df.copy(deep=False)
+
+    def invalidate(self, ticker: str) -> None:
+        """
+        Drop cached frames and the stored copy, e.g. after the scrapers rewrite a file.
+        """
+        self.CACHE.invalidate(ticker)
+        self.STORE.remove(ticker)
+
     def read(self, ticker: str) -> pd.DataFrame:
-        df = pd.read_csv(f"data/{ticker}_historical_price.csv")
+        return self.memoize(ticker, "read", None, lambda: self.load(ticker))
+
+    def load(self, ticker: str) -> pd.DataFrame:
+        """
+        Load from the columnar store, (re)ingesting the CSV if the store is stale.
+        """
+        if self.STORE.is_fresh(ticker, self.source(ticker)):
+            return self.STORE.load(ticker)
+        return self.ingest(ticker)
+
+    def read_csv(self, ticker: str) -> pd.DataFrame:
+        df = pd.read_csv(self.source(ticker))
         return self.preprocess(df)
 
+    def ingest(self, ticker: str) -> pd.DataFrame:
+        df = self.read_csv(ticker)
+        return self.STORE.write(ticker, df)
+
+    def ingest_all(self, tickers: List[str] = []) -> None:
+        if not tickers:
+            tickers = self.get_historical_prices().keys()
+
+        for ticker in tickers:
+            try:
+                self.ingest(ticker)
+            except Exception:
+                print(f"Failed to ingest {ticker}")
+                continue
+
     def returns(self, ticker: str, freq: str) -> pd.DataFrame:
+        return self.memoize(
+            ticker, "returns", freq, lambda: self.compute_returns(ticker, freq)
+        )
+
+    def compute_returns(self, ticker: str, freq: str) -> pd.DataFrame:
         df = self.get_asset_price(ticker, freq)
         df["day"] = df.index.dayofweek
         df = df.loc[df["day"] < 5]
         df["r"] = df["adj_close"] / df["adj_close"].shift() - 1
         return df.dropna()
+
+
+# Convert scraped price CSVs into the columnar store, e.g. after running the cafef scraper
+# python3 -m app.historical_price --ingest
+# python3 -m app.historical_price --ingest --tickers VNM SSI
+
+# Pairwise Kendall correlation files read by the II_correlation__ notebook
+# python3 -m app.historical_price --corr daily weekly monthly --workers 8
+
+# Evening refresh of the pairwise correlations, rolling 1 year of daily returns
+# python3 -m app.historical_price --update_corr daily --window 250
+
+# Lagged leader/follower scan across frequencies, one consolidated table
+# python3 -m app.historical_price --scan daily weekly monthly --lags 0 1 2 --workers 8
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ingest", action="store_true")
+    parser.add_argument("--tickers", nargs="+", default=[])
+    parser.add_argument("--corr", nargs="+", default=[], help="frequencies")
+    parser.add_argument("--scan", nargs="+", default=[], help="frequencies")
+    parser.add_argument("--update_corr", nargs="+", default=[], help="frequencies")
+    parser.add_argument("--window", type=int, default=None)
+    parser.add_argument("--lags", nargs="+", type=int, default=[0, 1, 2])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache_mb", type=int, default=None, help="price cache budget")
+
+    args = parser.parse_args()
+    hp = HistoricalPrice(args.cache_mb)
+    if args.ingest:
+        hp.ingest_all(args.tickers)
+    for freq in args.corr:
+        hp.save_corr(freq, args.workers)
+    for freq in args.update_corr:
+        hp.update_corr(freq, args.window).to_csv(
+            f"data/{freq}_returns_correlation_incremental.csv"
+        )
+    if args.scan:
+        hp.scan_lagged_corr(args.scan, args.lags, workers=args.workers)
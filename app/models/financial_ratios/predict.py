@@ -3,12 +3,14 @@ import argparse
 import pickle
 import warnings
 from datetime import datetime
-from typing import List
+from typing import List, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 
 from app.historical_price import HistoricalPrice
+from app.models.financial_ratios.preprocess_statements import REARRANGED
 from app.utils import write_to_log
 
 warnings.filterwarnings("ignore")
@@ -18,98 +20,115 @@ LOG_NAME = "financial_ratios_model"
 
 
 def get_financial_infos(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path)
-    df["date"] = pd.to_datetime(df["date"])
-    df = df.set_index(["date", "ticker"])
+    df = pd.read_parquet(path)
     df.loc[df["Net Profit After Tax"] == 0, "Net Profit After Tax"] = 0.00001
     write_to_log(LOG_NAME, "Financial statements info obtained.")
     return df
 
 
-def working_capital(row):
-    return row["Current Assets"] / row["Short term Liabilities"]
+# Ratio name -> (numerator, denominator), each a statement column or a nested ratio.
+# Evaluated on whole columns; the model inputs rely on the first four, in order.
+RATIOS = {
+    "RETURN_ON_EQUITY": ("Net Profit After Tax", "TOTAL EQUITY"),
+    "DEBT_TO_EQUITY": ("Liabilities", "TOTAL EQUITY"),
+    "WORKING_CAPITAL": ("Current Assets", "Short term Liabilities"),
+    "CASH_PER_SHARE": (
+        "Net cashflow from operating activities",
+        ("Net Profit After Tax", "Earnings  per share"),
+    ),
+}
 
 
-def return_on_equity(row):
-    return row["Net Profit After Tax"] / row["TOTAL EQUITY"]
+def divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """
+    Element-wise division, NaN (rather than inf) where the denominator is 0 or NaN.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = numerator / denominator
+    ratio[(denominator == 0) | np.isnan(denominator)] = np.nan
+    return ratio
 
 
-def debt_to_equity(row):
-    return row["Liabilities"] / row["TOTAL EQUITY"]
-
-
-def cash_per_share(row):
-    return row["Net cashflow from operating activities"] / (
-        row["Net Profit After Tax"] / row["Earnings  per share"]
-    )
+def evaluate(term: Union[str, Tuple], df: pd.DataFrame) -> np.ndarray:
+    if isinstance(term, str):
+        return df[term].to_numpy(dtype=np.float64)
+    numerator, denominator = term
+    return divide(evaluate(numerator, df), evaluate(denominator, df))
 
 
 def get_ratios(df: pd.DataFrame) -> pd.DataFrame:
-    df["RETURN_ON_EQUITY"] = df.apply(lambda x: return_on_equity(x), axis=1)
-    df["DEBT_TO_EQUITY"] = df.apply(lambda x: debt_to_equity(x), axis=1)
-    df["WORKING_CAPITAL"] = df.apply(lambda x: working_capital(x), axis=1)
-    df["CASH_PER_SHARE"] = df.apply(lambda x: cash_per_share(x), axis=1)
+    ratios = {name: evaluate(term, df) for name, term in RATIOS.items()}
+    df = df.assign(**ratios)
     write_to_log(LOG_NAME, "Financial ratios obtained.")
     return df
 
 
 def pca_reduce(df: pd.DataFrame) -> pd.DataFrame:
-    assert df.iloc[:, :-4].shape[1] == 576
+    statements = df.drop(columns=list(RATIOS))
+    assert statements.shape[1] == 576
     pca = pickle.load(open("app/models/financial_ratios/pca.pkl", "rb"))
-    data = pca.transform(df.iloc[:, :-4].fillna(0))
+    data = pca.transform(statements.fillna(0))
     data = pd.DataFrame(
         data,
         columns=[f"component_{i+1}" for i in range(data.shape[1])],
     )
 
     reduced_df = pd.DataFrame(data=data.values, columns=data.columns, index=df.index)
-    reduced_df = pd.concat([df.iloc[:, -4:], reduced_df], axis=1)
+    reduced_df = pd.concat([df.loc[:, list(RATIOS)], reduced_df], axis=1)
     write_to_log(LOG_NAME, "Principal components obtained.")
     return reduced_df
 
 
 def get_close(df: pd.DataFrame) -> pd.DataFrame:
-    adj = pd.DataFrame(columns=["date", "close", "ticker"])
     hp = HistoricalPrice()
     tickers = df.index.remove_unused_levels().levels[1]
+    adj = hp.get_closes(tickers, "monthly")
 
-    for ticker in tickers:
-        try:
-            close = hp.get_asset_price(ticker, "monthly")["close"].reset_index()
-            close["ticker"] = ticker
-            adj = pd.concat([adj, close])
-        except Exception:
-            continue
-
-    adj["date"] = pd.to_datetime(adj["date"])
-    adj = adj.set_index(["date", "ticker"])
     df = df.merge(adj, left_index=True, right_index=True, how="outer")
     df = df.dropna().drop_duplicates()
     write_to_log(LOG_NAME, "Closing prices obtained.")
     return df
 
 
-def get_lags(df: pd.DataFrame) -> pd.DataFrame:
-    lag_df = pd.DataFrame()
+def get_lags(df: pd.DataFrame, lags: int = 6) -> pd.DataFrame:
+    """
+    Lagged features of every column for all tickers at once, in one block.
+    Rows are grouped by ticker and sorted by date, lags never cross tickers.
+    Columns: features, then feature_lag1 for every feature, ..., then target,
+    the order the trained regressors expect.
+    """
+    df = df.sort_index(level=["ticker", "date"])
     train_columns = df.columns
-    tickers = df.index.remove_unused_levels().levels[1]
+    values = df.to_numpy(dtype=np.float64)
+    tickers = df.index.get_level_values("ticker").values
+    n, k = values.shape
+
+    block = np.full((n, k * lags), np.nan)
+    for i in range(1, lags + 1):
+        same_ticker = tickers[i:] == tickers[:-i]
+        block[i:, (i - 1) * k : i * k] = np.where(
+            same_ticker[:, None], values[:-i], np.nan
+        )
 
-    for ticker in tickers:
-        try:
-            t = df.loc[(slice(None), ticker), :].sort_index(ascending=True)
-            for i in range(6):
-                for col in train_columns:
-                    t[col + f"_lag{i+1}"] = t[col].shift(i + 1)
-            t["target"] = t["close"].shift(-1)
-            lag_df = pd.concat([lag_df, t], axis=0)
-        except Exception:
-            continue
+    close = df["close"].to_numpy(dtype=np.float64)
+    target = np.full(n, np.nan)
+    target[:-1] = np.where(tickers[:-1] == tickers[1:], close[1:], np.nan)
+
+    lag_columns = [f"{col}_lag{i}" for i in range(1, lags + 1) for col in train_columns]
+    lag_df = pd.concat(
+        [
+            df,
+            pd.DataFrame(block, index=df.index, columns=lag_columns),
+            pd.Series(target, index=df.index, name="target"),
+        ],
+        axis=1,
+    )
 
     shape_before = lag_df.shape
     lag_df = lag_df.dropna(subset=lag_df.columns.difference(["target"]), how="any")
     write_to_log(
         LOG_NAME,
-        f"Lag features obtained, {lag_df.shape[1]-shape_before[1]} rows with missing data were dropped.",
+        f"Lag features obtained, {shape_before[0]-lag_df.shape[0]} rows with missing data were dropped.",
     )
     return lag_df
 
@@ -186,8 +205,7 @@ def main():
     last = get_last_reporting_date()
     write_to_log(LOG_NAME, "#### INITIATE ####")
     write_to_log(LOG_NAME, f"Last reporting date: {last}")
-    path = "data/financial_statement_rearranged.csv"
-    df = get_financial_infos(path)
+    df = get_financial_infos(REARRANGED)
     df = df.loc[df.index.get_level_values("ticker").isin(constituents)]
     df = get_ratios(df)
 
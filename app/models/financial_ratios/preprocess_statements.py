@@ -1,54 +1,125 @@
+import argparse
 import glob
+import os
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+from app.utils import mkdir_p
 
-def read_statements() -> pd.DataFrame:
-    files = glob.glob("data/vnd_financial_statement*.csv")
-    for index, file in enumerate(files):
-        df = pd.read_csv(file, index_col=None).filter(
-            items=["ticker", "name", "value", "date"]
+STATEMENTS = "data/vnd_financial_statement"
+REARRANGED = "data/financial_statement_rearranged.parquet"
+CHUNKSIZE = 100000
+SCHEMA = pa.schema(
+    [
+        ("ticker", pa.dictionary(pa.int32(), pa.string())),
+        ("name", pa.dictionary(pa.int32(), pa.string())),
+        ("value", pa.float64()),
+        ("date", pa.timestamp("ns")),
+    ]
+)
+
+
+def ingest_statements(path: str = STATEMENTS, chunksize: int = CHUNKSIZE) -> int:
+    """
+    Parquet dataset of the scraped statement CSVs, one part per CSV.
+    Only parts older than their CSV are (re)written, parts of removed CSVs
+    are deleted.
+    """
+    mkdir_p(path)
+    files = sorted(glob.glob("data/vnd_financial_statement*.csv"))
+    parts = {f"{path}/{Path(file).stem}.parquet": file for file in files}
+    stale = [
+        (file, part)
+        for part, file in parts.items()
+        if not os.path.exists(part) or os.path.getmtime(part) < os.path.getmtime(file)
+    ]
+    rows = sum(ingest_statement(file, part, chunksize) for file, part in stale)
+    for part in glob.glob(f"{path}/*.parquet"):
+        if part not in parts:
+            os.remove(part)
+    print(f"{rows} statement rows from {len(stale)} of {len(files)} files")
+    return rows
+
+
+def ingest_statement(file: str, part: str, chunksize: int = CHUNKSIZE) -> int:
+    """
+    Stream one CSV into its parquet part, chunk by chunk, with typed columns.
+    Rows already written (same ticker, name, value and date) are skipped;
+    their 64-bit hashes are kept for this file only.
+    """
+    seen = set()
+    rows = 0
+    # hidden, so readers of the dataset skip it
+    tmp = f"{os.path.dirname(part)}/.{os.path.basename(part)}.tmp"
+    with pq.ParquetWriter(tmp, SCHEMA) as writer:
+        chunks = pd.read_csv(
+            file,
+            usecols=SCHEMA.names,
+            dtype={"ticker": "category", "name": "category", "value": "float64"},
+            parse_dates=["date"],
+            chunksize=chunksize,
         )
-        if index == 0:
-            data = df.copy()
-        else:
-            data = pd.concat([data, df.copy()], axis=0)
-    return data
+        for chunk in chunks:
+            chunk = chunk.loc[:, SCHEMA.names].drop_duplicates()
+            hashes = pd.util.hash_pandas_object(chunk, index=False).values
+            new = np.fromiter((h not in seen for h in hashes), bool, len(hashes))
+            if not new.any():
+                continue
+            seen.update(hashes[new])
+            table = pa.Table.from_pandas(
+                chunk[new], schema=SCHEMA, preserve_index=False
+            )
+            writer.write_table(table)
+            rows += table.num_rows
+    os.replace(tmp, part)
+    return rows
+
 
+def read_statements(path: str = STATEMENTS, ingest: bool = True) -> pd.DataFrame:
+    if ingest or not os.path.exists(path):
+        ingest_statements(path)
+    return pd.read_parquet(path)
 
-def rearrange_statements(data: pd.DataFrame) -> pd.DataFrame:
+
+def rearrange_statements(data: pd.DataFrame, path: str = REARRANGED) -> pd.DataFrame:
+    """
+    Long statements (ticker, name, value, date) to one row per (date, ticker)
+    and one float column per item name, with a single pivot.
+    An item name repeated for the same ticker and date (e.g. reported in two
+    statements) keeps its first value in (ticker, name, date) descending order.
+    Rows are ordered by ticker, latest date first; columns by item name.
+    """
+    # categories of the ingest are not sorted, order by the strings themselves
+    data = data.astype({"ticker": object, "name": object})
     data = data.sort_values(by=["ticker", "name", "date"], ascending=False)
-    data = data.drop_duplicates().dropna(subset=["name"]).reset_index(drop=True)
-
-    # SORT
-    tickers = list(sorted(set(data["ticker"])))
-    names = list(sorted(set(data["name"])))
-    dates = list(sorted(set(data["date"]), reverse=True))
-
-    # CREATE dataframe, and fill data
-    index = pd.MultiIndex(levels=[[], []], codes=[[], []], names=["date", "ticker"])
-    df = pd.DataFrame(columns=names, index=index)
-
-    for ticker in tickers:
-        for date in dates:
-            ticker_data = data.loc[
-                (data["ticker"] == ticker) & (data["date"] == date), ["name", "value"]
-            ]
-            ticker_data = ticker_data.set_index("name").T
-            ticker_data["date"] = date
-            ticker_data["ticker"] = ticker
-            ticker_data = ticker_data.set_index(["date", "ticker"])
-            ticker_data = ticker_data.loc[:, ~ticker_data.columns.duplicated()].copy()
-
-            if ticker_data.empty:
-                continue
-            else:
-                df = pd.concat([df, ticker_data], axis=0)
-                print(df.shape)
-    df.to_csv("data/financial_statement_rearranged.csv")
+    data = data.drop_duplicates().dropna(subset=["ticker", "name", "date"])
+    data = data.drop_duplicates(subset=["date", "ticker", "name"], keep="first")
+
+    data["date"] = pd.to_datetime(data["date"])
+    data["value"] = pd.to_numeric(data["value"], errors="coerce").astype(np.float64)
+
+    df = data.set_index(["date", "ticker", "name"])["value"].unstack("name")
+    df = df.sort_index(level=["ticker", "date"], ascending=[True, False])
+    df.columns.name = None
+    df.to_parquet(path)
+    print(df.shape)
+    return df
 
 
 #  python3 -m app.models.financial_ratios.preprocess_statements
+#  python3 -m app.models.financial_ratios.preprocess_statements --no-ingest
 if __name__ == "__main__":
-    df = read_statements()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--no-ingest",
+        action="store_true",
+        help="reuse the ingested statements without checking the CSVs",
+    )
+    args = parser.parse_args()
+
+    df = read_statements(ingest=not args.no_ingest)
     rearrange_statements(df)
@@ -0,0 +1,194 @@
+import argparse
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.historical_price import HistoricalPrice
+from app.models.regime_clustering.regime_clustering import (
+    GMMHMM,
+    LAGS,
+    PATIENCE,
+    RESTARTS,
+)
+from app.models.regime_clustering.registry import ModelRegistry
+
+warnings.filterwarnings("ignore")
+
+STATES = "app/models/regime_clustering/states.parquet"
+
+
+def get_closes(tickers: List[str] = []) -> Dict[str, pd.Series]:
+    hp = HistoricalPrice()
+    if not tickers:
+        tickers = hp.get_historical_prices().keys()
+
+    closes = {}
+    for ticker in tickers:
+        try:
+            closes[ticker] = hp.get_asset_price(ticker, "daily")["close"].dropna()
+        except Exception:
+            continue
+    return closes
+
+
+def get_directions(closes: Dict[str, pd.Series], lag: int) -> Dict[str, pd.DataFrame]:
+    """
+    GMMHMM.get_direction for every ticker in one pass: trading days are stacked
+    by position into one (days x tickers) panel, padded with NaN, so a single
+    sliding window gives the weighted moving averages of the whole universe.
+    """
+    lengths = [len(close) for close in closes.values()]
+    panel = np.full((max(lengths, default=0), len(closes)), np.nan)
+    for j, close in enumerate(closes.values()):
+        panel[: len(close), j] = close.values
+
+    ma = np.full_like(panel, np.nan)
+    if len(panel) >= lag:
+        # same weights as df.ta.wma: 1 for the oldest point, lag for the latest
+        windows = sliding_window_view(panel, lag, axis=0)
+        ma[lag - 1 :] = windows @ np.arange(1, lag + 1) / (0.5 * lag * (lag + 1))
+    ma_lagged = np.full_like(panel, np.nan)
+    ma_lagged[lag:] = ma[:-lag]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = panel / ma_lagged - 1
+        directional_change = returns / np.abs(returns)
+
+    directions = {}
+    for j, (ticker, close) in enumerate(closes.items()):
+        n = len(close)
+        df = pd.DataFrame(
+            {
+                f"ma_{lag}": ma[:n, j],
+                f"returns_{lag}": returns[:n, j],
+                f"directional_change_{lag}": directional_change[:n, j],
+            },
+            index=close.index,
+        )
+        directions[ticker] = df.fillna(method="bfill").dropna()
+    return directions
+
+
+def cluster_directions(job: Tuple) -> Tuple[str, int, pd.Series, str]:
+    """
+    Fit (or reuse) the model of one ticker and lag, then decode its states.
+    Old models are evicted by the parent process, not by the workers.
+    """
+    ticker, lag, df, restarts, patience, cold = job
+    gmmhmm = GMMHMM()
+    gmmhmm.set_column_features(df)
+    fit = gmmhmm.fit(ticker, lag, df, restarts, patience, 1, cold, evict=False)
+    states = pd.Series(gmmhmm.model.predict(df.loc[:, gmmhmm.cols]), index=df.index)
+    return ticker, lag, states, fit
+
+
+def cluster_all(
+    tickers: List[str] = [],
+    lags: List[int] = LAGS,
+    restarts: int = RESTARTS,
+    patience: int = PATIENCE,
+    workers: int = None,
+    cold: bool = False,
+) -> pd.DataFrame:
+    """
+    Regimes of every ticker and lag. Direction features come from the shared
+    price panel, fits are spread over a process pool (one job per ticker and lag),
+    and all states are written into one table indexed by (date, ticker, lag).
+    """
+    closes = get_closes(tickers)
+    jobs = [
+        (ticker, lag, df, restarts, patience, cold)
+        for lag in lags
+        for ticker, df in get_directions(closes, lag).items()
+        if len(df) > lag
+    ]
+
+    registry = ModelRegistry()
+    states = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(cluster_directions, job): job[:2] for job in jobs}
+        for i, future in enumerate(as_completed(futures), start=1):
+            ticker, lag = futures[future]
+            try:
+                _, _, state, fit = future.result()
+                states.append(
+                    pd.DataFrame(
+                        {"ticker": ticker, "lag": lag, "state": state.values},
+                        index=state.index.rename("date"),
+                    )
+                )
+                status = fit
+                registry.evict(ticker, lag)
+            except Exception as e:
+                status = f"failed ({e})"
+            print(
+                f"[{i}/{len(jobs)}] {ticker} lag {lag}: {status}, "
+                f"{time.time() - start:.0f}s elapsed"
+            )
+
+    if not states:
+        return pd.DataFrame()
+    states = (
+        pd.concat(states)
+        .reset_index()
+        .astype({"lag": np.int16, "state": np.int8})
+        .set_index(["date", "ticker", "lag"])
+    )
+    return save_states(states)
+
+
+def save_states(states: pd.DataFrame, path: str = STATES) -> pd.DataFrame:
+    """
+    Replace the (ticker, lag) series present in `states`, keep the others.
+    """
+    if os.path.exists(path):
+        previous = pd.read_parquet(path)
+        keys = states.index.droplevel("date").unique()
+        keep = ~previous.index.droplevel("date").isin(keys)
+        states = pd.concat([previous[keep], states])
+    states = states.sort_index()
+    states.to_parquet(path)
+    return states
+
+
+def read_states(
+    tickers: List[str] = [], lags: List[int] = [], path: str = STATES
+) -> pd.DataFrame:
+    """
+    State table, optionally of some tickers and lags only.
+    """
+    if not os.path.exists(path):
+        return None
+    filters = []
+    if tickers:
+        filters.append(("ticker", "in", list(tickers)))
+    if lags:
+        filters.append(("lag", "in", list(lags)))
+    return pd.read_parquet(path, filters=filters or None)
+
+
+# python3 -m app.models.regime_clustering.batch --workers 8
+# python3 -m app.models.regime_clustering.batch --tickers DRH ITQ NSH --lags 3 5
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", nargs="+", default=[])
+    parser.add_argument("--lags", nargs="+", type=int, default=LAGS)
+    parser.add_argument("--restarts", type=int, default=RESTARTS)
+    parser.add_argument("--patience", type=int, default=PATIENCE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--cold", action="store_true", help="refit from scratch, no warm start"
+    )
+
+    args = parser.parse_args()
+    states = cluster_all(
+        args.tickers, args.lags, args.restarts, args.patience, args.workers, args.cold
+    )
+    print(states.groupby(level=["ticker", "lag"]).size().unstack())
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pandas as pd
+from hmmlearn import hmm
+from scipy.special import logsumexp
+
+from app.utils import mkdir_p
+
+DIR = "app/models/regime_clustering/online"
+
+
+class ForwardFilter:
+    """
+    Filtered regime probabilities P(state_t | x_1, ..., x_t) of a fitted HMM,
+    updated with new observations only, one O(n_components^2) step per day.
+    Persisted per (ticker, lag) along with the key of the model it runs,
+    and rebuilt from the first observation when that model changes.
+    """
+
+    def __init__(self, ticker: str, lag: int, path: str = DIR):
+        self.ticker = ticker
+        self.lag = lag
+        self.path = path
+        self.reset(None)
+
+    def file(self) -> str:
+        return f"{self.path}/{self.ticker}_{self.lag}.npz"
+
+    def reset(self, key: str) -> None:
+        self.key = key
+        self.log_alpha = None
+        self.dates = np.array([], dtype="datetime64[ns]")
+        self.probs = None
+
+    def load(self) -> bool:
+        if not os.path.exists(self.file()):
+            return False
+        state = np.load(self.file(), allow_pickle=False)
+        self.key = str(state["key"])
+        self.log_alpha = state["log_alpha"]
+        self.dates = state["dates"]
+        self.probs = state["probs"]
+        return True
+
+    def save(self) -> None:
+        mkdir_p(self.path)
+        # np.savez appends .npz to names without it
+        tmp = f"{self.file()}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp,
+            key=self.key,
+            log_alpha=self.log_alpha,
+            dates=self.dates,
+            probs=self.probs,
+        )
+        os.replace(tmp, self.file())
+
+    def step(self, model: hmm.GMMHMM, X: np.ndarray) -> np.ndarray:
+        """
+        Filter observations in order, starting from the current state.
+        """
+        log_b = model._compute_log_likelihood(X)
+        with np.errstate(divide="ignore"):
+            log_start = np.log(model.startprob_)
+            log_trans = np.log(model.transmat_)
+
+        log_alpha = self.log_alpha
+        filtered = np.empty_like(log_b)
+        for t in range(len(log_b)):
+            if log_alpha is None:
+                prior = log_start
+            else:
+                prior = logsumexp(log_alpha[:, None] + log_trans, axis=0)
+            log_alpha = prior + log_b[t]
+            log_alpha -= logsumexp(log_alpha)
+            filtered[t] = log_alpha
+        self.log_alpha = log_alpha
+        return np.exp(filtered)
+
+    def update(self, model: hmm.GMMHMM, key: str, features: pd.DataFrame) -> None:
+        """
+        Filter the observations dated after the last one seen.
+        """
+        if key != self.key:
+            self.reset(key)
+        dates = features.index.values.astype("datetime64[ns]")
+        new = dates > self.dates[-1] if len(self.dates) else np.ones(len(dates), bool)
+        if not new.any():
+            return
+
+        probs = self.step(model, features.values[new])
+        self.dates = np.concatenate([self.dates, dates[new]])
+        self.probs = probs if self.probs is None else np.vstack([self.probs, probs])
+
+    def states(self) -> pd.DataFrame:
+        """
+        Most likely state and posterior probabilities of every filtered day.
+        """
+        states = pd.DataFrame(
+            self.probs,
+            index=pd.DatetimeIndex(self.dates),
+            columns=[f"prob_{i}" for i in range(self.probs.shape[1])],
+        )
+        states["state"] = self.probs.argmax(axis=1)
+        return states
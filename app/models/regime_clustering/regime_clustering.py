@@ -1,7 +1,12 @@
 import argparse
+import copy
 import logging
 import os
 import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, Iterator, List
 
 import numpy as np
 import pandas as pd
@@ -11,9 +16,53 @@ import plotly.subplots as sp
 from hmmlearn import hmm
 
 from app.historical_price import HistoricalPrice
+from app.models.regime_clustering.online import ForwardFilter
+from app.models.regime_clustering.registry import ModelRegistry
 
 logging.getLogger("hmmlearn").setLevel("CRITICAL")
 
+LAGS = [3, 5, 20, 200]
+RESTARTS = 100
+PATIENCE = 20
+# model hyperparameters, part of a model's registry key
+HYPERPARAMS = {"n_components": 2, "n_iter": 10000}
+# EM iterations of a warm-started refit
+WARM_ITER = 100
+
+
+def fit_restart(X: np.ndarray, seed: int) -> Dict:
+    """
+    One restart of the multi-start fit, initialized from its own seed.
+    """
+    start = time.time()
+    result = {"seed": seed, "score": np.nan, "converged": False, "n_iter": 0}
+    model = None
+    try:
+        model = hmm.GMMHMM(**HYPERPARAMS, random_state=seed)
+        model.fit(X)
+        result["score"] = model.score(X)
+        result["converged"] = model.monitor_.converged
+        result["n_iter"] = model.monitor_.iter
+    except Exception:
+        model = None
+    result["fit_time"] = time.time() - start
+    result["model"] = model
+    return result
+
+
+def fit_restarts(X: np.ndarray, seeds: List[int], workers: int) -> Iterator[Dict]:
+    """
+    Restarts in seed order, run in waves of `workers` on a process pool
+    so the caller can stop early without fitting the remaining seeds.
+    """
+    if workers == 1:
+        yield from (fit_restart(X, seed) for seed in seeds)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for i in range(0, len(seeds), workers):
+            yield from executor.map(fit_restart, repeat(X), seeds[i : i + workers])
+
 
 class GMMHMM:
     def set_column_features(self, df: pd.DataFrame):
@@ -60,24 +109,131 @@ class GMMHMM:
         )
         return df.fillna(method="bfill").dropna()
 
-    def get_best_model(self, df: pd.DataFrame) -> None:
+    def get_best_model(
+        self,
+        df: pd.DataFrame,
+        restarts: int = RESTARTS,
+        patience: int = PATIENCE,
+        workers: int = None,
+        seed: int = 0,
+    ) -> None:
         """
-        Fit GMMHMM 10000 times and pick the best model.
+        Fit GMMHMM from up to `restarts` seeds and pick the best model.
         (minimize randomness)
+        Stops once the best score hasn't improved for `patience` restarts.
+        Per-restart statistics are kept in self.restarts.
         """
-        best_mle = -100000
+        X = df.loc[:, self.cols].values
+        seeds = list(range(seed, seed + restarts))
+        workers = workers or os.cpu_count()
+
+        best_mle = -np.inf
         best_model = None
-        for i in range(100):
+        stale = 0
+        stats = []
+        for result in fit_restarts(X, seeds, workers):
+            model = result.pop("model")
+            stats.append(result)
+            if model is not None and result["score"] > best_mle:
+                best_mle = result["score"]
+                best_model = model
+                stale = 0
+            else:
+                stale += 1
+            if patience and stale >= patience:
+                break
+        self.model = best_model
+        self.restarts = pd.DataFrame(stats)
+
+    def warm_start(self, df: pd.DataFrame, model: hmm.GMMHMM) -> None:
+        """
+        Refit from a previous model's parameters with a short EM run,
+        instead of cold restarts.
+        """
+        X = df.loc[:, self.cols].values
+        start = time.time()
+        model = copy.deepcopy(model)
+        model.init_params = ""
+        model.n_iter = WARM_ITER
+        model.fit(X)
+        self.model = model
+        self.restarts = pd.DataFrame(
+            [
+                {
+                    "seed": None,
+                    "score": model.score(X),
+                    "converged": model.monitor_.converged,
+                    "n_iter": model.monitor_.iter,
+                    "fit_time": time.time() - start,
+                }
+            ]
+        )
+
+    def fit(
+        self,
+        ticker: str,
+        lag: int,
+        df: pd.DataFrame,
+        restarts: int = RESTARTS,
+        patience: int = PATIENCE,
+        workers: int = None,
+        cold: bool = False,
+        evict: bool = True,
+    ) -> str:
+        """
+        Use the model registered for these features. Without one, the latest
+        model of the ticker and lag is refit on the new data (warm start),
+        or restarts are fit from scratch (cold start).
+        Returns how the model was obtained: registry, warm or cold.
+        """
+        legacy_path = f"app/models/regime_clustering/{ticker}_{lag}.pkl"
+
+        registry = ModelRegistry()
+        identity = registry.key(ticker, lag, df.loc[:, self.cols], HYPERPARAMS)
+        model = registry.get(identity["key"])
+        if model is not None:
+            self.model = model
+            self.prime_filter(ticker, lag, identity["key"], df)
+            return "registry"
+
+        previous = None if cold else registry.latest(ticker, lag, HYPERPARAMS)
+        if previous is None and not cold and os.path.exists(legacy_path):
+            self.load_model(legacy_path)
+            previous = self.model
+
+        fit = "cold"
+        if previous is not None:
             try:
-                model = hmm.GMMHMM(n_components=2, n_iter=10000)
-                model.fit(df.loc[:, self.cols])
-                mle = model.score(df.loc[:, self.cols])
-                if mle > best_mle:
-                    best_mle = mle
-                    best_model = model
+                self.warm_start(df, previous)
+                fit = "warm"
             except Exception:
-                continue
-        self.model = best_model
+                previous = None
+        if previous is None:
+            self.get_best_model(df, restarts, patience, workers)
+
+        registry.put(
+            identity,
+            self.model,
+            fit=fit,
+            score=self.restarts["score"].max(),
+            n_obs=len(df),
+            restarts=len(self.restarts),
+        )
+        self.restarts.to_csv(registry.file(identity["key"], "csv"), index=False)
+        self.prime_filter(ticker, lag, identity["key"], df)
+        if evict:
+            registry.evict(ticker, lag)
+        return fit
+
+    def prime_filter(self, ticker: str, lag: int, key: str, df: pd.DataFrame) -> None:
+        """
+        Forward filter the fitted data with the model at fit time, so live runs
+        (online_cluster) only filter the days added since.
+        """
+        forward_filter = ForwardFilter(ticker, lag)
+        forward_filter.load()
+        forward_filter.update(self.model, key, df.loc[:, self.cols])
+        forward_filter.save()
 
     def save_plot(self, df: pd.DataFrame, plot_path: str) -> None:
         df = self.post_processing(df)
@@ -108,47 +264,96 @@ class GMMHMM:
         self.model = pickle.load(open(path, "rb"))
 
 
-def cluster(ticker: str, lag: int) -> pd.DataFrame:
+def cluster(
+    ticker: str,
+    lag: int,
+    restarts: int = RESTARTS,
+    patience: int = PATIENCE,
+    workers: int = None,
+    cold: bool = False,
+) -> pd.DataFrame:
     hp = HistoricalPrice()
     df = hp.get_asset_price(ticker, "daily")
 
-    model_path = f"app/models/regime_clustering/{ticker}_{lag}.pkl"
     plot_path = f"app/models/regime_clustering/{ticker}_{lag}.html"
 
     gmmhmm = GMMHMM()
     df = gmmhmm.feature_engineer(df, lag)
-
-    if os.path.exists(model_path):
-        gmmhmm.load_model(model_path)
-    else:
-        gmmhmm.get_best_model(df)
-        gmmhmm.save_model(model_path)
+    gmmhmm.fit(ticker, lag, df, restarts, patience, workers, cold)
 
     clustered_df = gmmhmm.batch_predict(df)
     gmmhmm.save_plot(clustered_df, plot_path)
     return clustered_df
 
 
+def online_cluster(ticker: str, lag: int) -> pd.DataFrame:
+    """
+    Regimes from the forward filter of the latest registered model, updated
+    with the days since its last run only: no refit, no decoding of the history.
+    The filter of a model is primed when it is fit, see GMMHMM.prime_filter.
+    Falls back to cluster() when no model is registered yet.
+    """
+    hp = HistoricalPrice()
+    df = hp.get_asset_price(ticker, "daily")
+
+    gmmhmm = GMMHMM()
+    df = gmmhmm.feature_engineer(df, lag)
+
+    registry = ModelRegistry()
+    key = registry.latest_key(ticker, lag, HYPERPARAMS)
+    if key is None:
+        cluster(ticker, lag)
+        key = registry.latest_key(ticker, lag, HYPERPARAMS)
+
+    forward_filter = ForwardFilter(ticker, lag)
+    forward_filter.load()
+    forward_filter.update(registry.get(key), key, df.loc[:, gmmhmm.cols])
+    forward_filter.save()
+    return df.join(forward_filter.states())
+
+
 def main():
-    clustered_df = cluster(args.ticker, args.lag)
-    return clustered_df
+    for ticker in args.tickers:
+        for lag in args.lags:
+            if args.online:
+                last = online_cluster(ticker, lag).iloc[-1]
+                probs = {c: round(last[c], 4) for c in last.index if "prob_" in c}
+                print(f"{ticker} lag {lag}: state {last['state']} {probs}")
+                continue
+            start = time.time()
+            cluster(ticker, lag, args.restarts, args.patience, args.workers, args.cold)
+            print(f"{ticker} lag {lag}: {time.time() - start:.1f}s")
 
 
-# python3 -m app.models.regime_clustering.regime_clustering --ticker DRH --lag 3
+# python3 -m app.models.regime_clustering.regime_clustering --tickers DRH --lags 3
+# python3 -m app.models.regime_clustering.regime_clustering --tickers DRH --online
+# NIGHTLY, all lags of the traded pairs' targets
+# python3 -m app.models.regime_clustering.regime_clustering --tickers HDB VND FTS CTS BSI TLH DIG PVS DRH MBS EVG NSH ITQ --workers 8
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--ticker",
-        help="Which stock?",
-        type=str,
+        "--tickers",
+        help="Which stocks?",
+        nargs="+",
         required=True,
     )
-
+    parser.add_argument("--lags", nargs="+", type=int, default=LAGS)
+    parser.add_argument("--restarts", type=int, default=RESTARTS)
     parser.add_argument(
-        "--lag",
+        "--patience",
         type=int,
-        required=True,
+        default=PATIENCE,
+        help="stop once the best score hasn't improved for this many restarts, 0 to run all",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--cold", action="store_true", help="refit from scratch, no warm start"
+    )
+    parser.add_argument(
+        "--online",
+        action="store_true",
+        help="latest states from the forward filter, no refit",
     )
 
     args = parser.parse_args()
-    # main()
+    main()
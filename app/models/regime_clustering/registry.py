@@ -0,0 +1,148 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+from app.utils import mkdir_p, now_ts
+
+DIR = "app/models/regime_clustering/registry"
+# models kept per (ticker, lag), least recently used are evicted first
+KEEP = 3
+
+
+class ModelRegistry:
+    """
+    Content-addressed store of fitted regime models.
+    A model is keyed by ticker, lag, a hash of its features, the data end-date
+    and the hyperparameters, so any change to them gets a new model.
+    Each entry is a pickle plus a JSON metadata sidecar named by its key,
+    which starts with the ticker and lag so their entries are found by name.
+    Files are replaced atomically, so processes fitting other tickers and lags
+    can share the registry; evict is left to the process that started them.
+    """
+
+    def __init__(self, path: str = DIR, keep: int = KEEP):
+        self.path = path
+        self.keep = keep
+
+    @staticmethod
+    def feature_hash(features: pd.DataFrame) -> str:
+        digest = hashlib.sha1(",".join(features.columns).encode())
+        digest.update(np.ascontiguousarray(features.values).tobytes())
+        return digest.hexdigest()
+
+    def key(
+        self, ticker: str, lag: int, features: pd.DataFrame, params: Dict
+    ) -> Dict[str, Any]:
+        """
+        Identity of a model, with its content address under "key".
+        """
+        identity = {
+            "ticker": ticker,
+            "lag": lag,
+            "feature_hash": self.feature_hash(features),
+            "end_date": str(pd.Timestamp(features.index[-1]).date()),
+            "params": params,
+        }
+        digest = hashlib.sha1(json.dumps(identity, sort_keys=True).encode())
+        return {"key": f"{ticker}_{lag}_{digest.hexdigest()}", **identity}
+
+    def file(self, key: str, ext: str) -> str:
+        return f"{self.path}/{key}.{ext}"
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.file(key, "pkl"))
+
+    def get(self, key: str) -> Any:
+        try:
+            model = pickle.load(open(self.file(key, "pkl"), "rb"))
+        except FileNotFoundError:
+            return None
+        self.touch(key)
+        return model
+
+    def put(self, identity: Dict, model: Any, **meta) -> None:
+        mkdir_p(self.path)
+        key = identity["key"]
+        self.replace(key, "pkl", lambda f: pickle.dump(model, f), "wb")
+        meta = {**identity, **meta, "created": now_ts(), "last_used": now_ts()}
+        self.write_meta(key, meta)
+
+    def replace(self, key: str, ext: str, write, mode: str = "w") -> None:
+        """
+        Write to a temporary file first, readers see the old or the new file.
+        """
+        tmp = f"{self.file(key, ext)}.{os.getpid()}.tmp"
+        with open(tmp, mode) as f:
+            write(f)
+        os.replace(tmp, self.file(key, ext))
+
+    def write_meta(self, key: str, meta: Dict) -> None:
+        self.replace(key, "json", lambda f: json.dump(meta, f, indent=4, default=str))
+
+    def touch(self, key: str) -> None:
+        meta = self.meta(key)
+        if meta is None:
+            return
+        meta["last_used"] = now_ts()
+        self.write_meta(key, meta)
+
+    def meta(self, key: str) -> Dict:
+        try:
+            return json.load(open(self.file(key, "json")))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def entries(self, ticker: str = None, lag: int = None) -> pd.DataFrame:
+        """
+        Metadata of all models, optionally of one ticker and lag.
+        Entries removed while listing are skipped.
+        """
+        pattern = "*" if ticker is None else f"{ticker}_{'*' if lag is None else lag}_*"
+        metas = [
+            self.meta(os.path.basename(f)[: -len(".json")])
+            for f in glob.glob(f"{self.path}/{pattern}.json")
+        ]
+        entries = pd.DataFrame([meta for meta in metas if meta is not None])
+        if entries.empty:
+            return entries
+        if ticker is not None:
+            entries = entries[entries["ticker"] == ticker]
+        if lag is not None:
+            entries = entries[entries["lag"] == lag]
+        return entries
+
+    def latest_key(self, ticker: str, lag: int, params: Dict) -> str:
+        """
+        Key of the model fitted on the most recent data with the same
+        hyperparameters, to warm-start a refit or run inference from.
+        """
+        entries = self.entries(ticker, lag)
+        if entries.empty:
+            return None
+        entries = entries[entries["params"].apply(lambda p: p == params)]
+        if entries.empty:
+            return None
+        return entries.sort_values(by=["end_date", "created"])["key"].iloc[-1]
+
+    def latest(self, ticker: str, lag: int, params: Dict) -> Any:
+        key = self.latest_key(ticker, lag, params)
+        return None if key is None else self.get(key)
+
+    def evict(self, ticker: str, lag: int) -> None:
+        entries = self.entries(ticker, lag)
+        if len(entries) <= self.keep:
+            return
+        entries = entries.sort_values(by=["last_used"], ascending=False)
+        for key in entries["key"].iloc[self.keep :]:
+            self.remove(key)
+
+    def remove(self, key: str) -> None:
+        for ext in ["pkl", "json", "csv"]:
+            if os.path.exists(self.file(key, ext)):
+                os.remove(self.file(key, ext))
@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+
+from app.utils import mkdir_p
+
+
+class PriceStore:
+    """
+    Columnar copy of the scraped historical price CSVs.
+    One parquet file per ticker, typed columns and a pre-sorted datetime index,
+    so loading a ticker skips CSV parsing and date conversion entirely.
+    """
+
+    DIR = "data/store"
+    DTYPES = {
+        "adj_close": "float32",
+        "close": "float32",
+        "order_matching_volume": "int64",
+        "order_matching_value": "int64",
+        "order_negotiated_volume": "int64",
+        "order_negotiated_value": "int64",
+        "open": "float32",
+        "high": "float32",
+        "low": "float32",
+        "volume": "int64",
+    }
+
+    def path(self, ticker: str) -> str:
+        return f"{self.DIR}/{ticker}_historical_price.parquet"
+
+    def exists(self, ticker: str) -> bool:
+        return os.path.exists(self.path(ticker))
+
+    def is_fresh(self, ticker: str, source: str) -> bool:
+        """
+        Stored copy is usable if it is at least as recent as the scraped CSV.
+        """
+        if not self.exists(ticker):
+            return False
+        if not os.path.exists(source):
+            return True
+        return os.path.getmtime(self.path(ticker)) >= os.path.getmtime(source)
+
+    def mtime(self, ticker: str) -> float:
+        return os.path.getmtime(self.path(ticker))
+
+    def cast(self, df: pd.DataFrame) -> pd.DataFrame:
+        dtypes = {col: dtype for col, dtype in self.DTYPES.items() if col in df.columns}
+        for col, dtype in dtypes.items():
+            if dtype == "int64":
+                df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).round()
+        return df.astype(dtypes)
+
+    def write(self, ticker: str, df: pd.DataFrame) -> pd.DataFrame:
+        mkdir_p(self.DIR)
+        df = self.cast(df)
+        df.to_parquet(self.path(ticker))
+        return df
+
+    def load(self, ticker: str) -> pd.DataFrame:
+        return pd.read_parquet(self.path(ticker))
+
+    def remove(self, ticker: str) -> None:
+        if self.exists(ticker):
+            os.remove(self.path(ticker))
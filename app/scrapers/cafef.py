@@ -8,37 +8,96 @@ from datetime import datetime
 from typing import List
 
 import pandas as pd
+import requests
 
-from app.scrapers.base import ScrapeToolbox, write_to_log
+from app.historical_price import HistoricalPrice
+from app.scrapers.session import PooledSession
 from app.scrapers.vndirect import Ticker
+from app.utils import write_to_log
 
 START_DATE = "01/01/2000"
 END_DATE = datetime.now().date().strftime("%m/%d/%Y")
 
 
-class StockPrice(ScrapeToolbox):
+class DataHistory:
+    """
+    cafef DataHistory endpoints return JSON, so they are fetched directly
+    over a pooled HTTP session. The headless browser (and selenium) is only
+    loaded when the request fails or does not return JSON, or when `browser`
+    is set.
+    """
+
+    LOG_NAME = "cafedh"
+    ENDPOINT = None
+    HEADERS = {
+        "Accept": "application/json, text/plain, */*",
+        "Referer": "https://s.cafef.vn/",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36",
+    }
+
+    def __init__(self, session: PooledSession = None, browser: bool = False):
+        self.session = session or PooledSession(headers=self.HEADERS)
+        self.browser = browser
+
+    def url(self, ticker: str, page_size: int) -> str:
+        return f"https://s.cafef.vn/Ajax/PageNew/DataHistory/{self.ENDPOINT}?Symbol={ticker}&StartDate={START_DATE}&EndDate={END_DATE}&PageIndex=1&PageSize={page_size}"
+
+    def get_data(self, ticker: str, page_size: int) -> pd.DataFrame:
+        if not self.browser:
+            try:
+                return self.process_json(self.fetch(ticker, page_size))
+            except (requests.RequestException, json.JSONDecodeError) as e:
+                write_to_log(
+                    self.LOG_NAME, f"{ticker}: direct fetch failed ({e}), using browser"
+                )
+        return self.process_html(self.fetch_browser(ticker, page_size))
+
+    def fetch(self, ticker: str, page_size: int) -> dict:
+        response = self.session.get(self.url(ticker, page_size))
+        response.raise_for_status()
+        return response.json()
+
+    def fetch_browser(self, ticker: str, page_size: int) -> str:
+        from app.scrapers.base import ScrapeToolbox
+
+        toolbox = ScrapeToolbox()
+        toolbox.LOG_NAME = self.LOG_NAME
+        try:
+            toolbox.start_driver(None)
+            toolbox.attack(self.url(ticker, page_size), t1=5)
+            time.sleep(random.randint(5, 10))
+            return toolbox.attack(
+                toolbox.DRIVER,
+                "//pre",
+                t1=10,
+                t2=5,
+            )[
+                0
+            ].get_attribute("innerHTML")
+        finally:
+            toolbox.close_driver()
+
+    def process_html(self, html: str) -> pd.DataFrame:
+        return self.process_json(json.loads(html))
+
+    def process_json(self, js: dict) -> pd.DataFrame:
+        """
+        Records of the response, empty when it has none ("Data": null).
+        """
+        data = (js.get("Data") or {}).get("Data") or []
+        return pd.DataFrame(data)
+
+
+class StockPrice(DataHistory):
     LOG_NAME = "cafesp"
+    ENDPOINT = "PriceHistory.ashx"
 
     def scrape(self, tickers: List[str], page_size: int = 9999):
         t = 0
         while t < len(tickers):
             try:
                 ticker = tickers[t]
-                self.start_driver(None)
-                self.attack(
-                    f"https://s.cafef.vn/Ajax/PageNew/DataHistory/PriceHistory.ashx?Symbol={ticker}&StartDate={START_DATE}&EndDate={END_DATE}&PageIndex=1&PageSize={page_size}",
-                    t1=5,
-                )
-                time.sleep(random.randint(5, 10))
-                html = self.attack(
-                    self.DRIVER,
-                    "//pre",
-                    t1=10,
-                    t2=5,
-                )[
-                    0
-                ].get_attribute("innerHTML")
-                data = self.process_html(html)
+                data = self.get_data(ticker, page_size)
                 if not data.empty:
                     self.save(ticker, data)
                 else:
@@ -46,13 +105,6 @@ class StockPrice(ScrapeToolbox):
                 t += 1
             except Exception:
                 write_to_log(self.LOG_NAME, traceback.format_exc())
-            finally:
-                self.close_driver()
-
-    def process_html(self, html: str) -> pd.DataFrame:
-        html_decoded = json.loads(html)["Data"]["Data"]
-        df = pd.DataFrame(html_decoded)
-        return df
 
     def save(self, ticker: str, data: pd.DataFrame) -> None:
         csv_file = f"data/{ticker}_historical_price.csv"
@@ -60,42 +112,26 @@ class StockPrice(ScrapeToolbox):
             existing_data = pd.read_csv(csv_file)
             data = pd.concat([data, existing_data], axis=0).drop_duplicates()
         data.to_csv(csv_file, index=False)
+        HistoricalPrice().invalidate(ticker)
 
 
-class OrderStatistic(ScrapeToolbox):
+class OrderStatistic(DataHistory):
     LOG_NAME = "cafeos"
+    ENDPOINT = "ThongKeDL.ashx"
 
     def scrape(self, tickers: List[str], page_size: int = 9999):
         t = 0
         while t < len(tickers):
             try:
                 ticker = tickers[t]
-                self.start_driver(None)
-                self.attack(
-                    f"https://s.cafef.vn/Ajax/PageNew/DataHistory/ThongKeDL.ashx?Symbol={ticker}&StartDate={START_DATE}&EndDate={END_DATE}&PageIndex=1&PageSize={page_size}",
-                    t1=5,
-                )
-                time.sleep(random.randint(5, 10))
-                html = self.attack(
-                    self.DRIVER,
-                    "//pre",
-                    t1=10,
-                    t2=5,
-                )[
-                    0
-                ].get_attribute("innerHTML")
-                data = self.process_html(html)
-                self.save(ticker, data)
+                data = self.get_data(ticker, page_size)
+                if not data.empty:
+                    self.save(ticker, data)
+                else:
+                    write_to_log(self.LOG_NAME, f"{tickers[t]}: no data obtained")
                 t += 1
             except Exception:
                 write_to_log(self.LOG_NAME, traceback.format_exc())
-            finally:
-                self.close_driver()
-
-    def process_html(self, html: str) -> pd.DataFrame:
-        html_decoded = json.loads(html)["Data"]["Data"]
-        df = pd.DataFrame(html_decoded)
-        return df
 
     def save(self, ticker: str, data: pd.DataFrame) -> None:
         csv_file = f"data/{ticker}_historical_order.csv"
@@ -105,6 +141,8 @@ class OrderStatistic(ScrapeToolbox):
         data.to_csv(csv_file, index=False)
 
 
+# python3 -m app.scrapers.cafef --scraper StockPrice --page_size 20 --tickers VNM SSI
+# python3 -m app.scrapers.cafef --scraper OrderStatistic --page_size 20 --browser
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -123,6 +161,11 @@ if __name__ == "__main__":
         type=int,
     )
     parser.add_argument("--tickers", nargs="+", default=[])
+    parser.add_argument(
+        "--browser",
+        help="Scrape with the headless browser instead of direct HTTP requests.",
+        action="store_true",
+    )
 
     args = parser.parse_args()
     if not args.tickers:
@@ -132,4 +175,4 @@ if __name__ == "__main__":
 
     scraper = args.scraper
     class_object = globals()[scraper]
-    class_object().scrape(tickers, args.page_size)
+    class_object(browser=args.browser).scrape(tickers, args.page_size)
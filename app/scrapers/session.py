@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# requests per second per host, bursts up to the same number
+RATE = 2
+POOL = 16
+RETRIES = 5
+BACKOFF = 1
+TIMEOUT = 30
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by threads: `rate` tokens per second,
+    at most `capacity` saved up, one token per request.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class PooledSession(requests.Session):
+    """
+    Keep-alive session for the scrapers. Connections are pooled across threads,
+    every host gets its own token bucket, and connection errors, 429 and 5xx
+    responses are retried with exponential backoff (honouring Retry-After).
+    Retries are made here rather than by the adapter, so each attempt takes
+    a token from the host's bucket.
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE,
+        pool: int = POOL,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        headers: Dict = None,
+    ):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        if headers:
+            self.headers.update(headers)
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate)
+            return self.buckets[host]
+
+    def request(self, method, url, *args, **kwargs) -> requests.Response:
+        bucket = self.bucket(urlparse(url).netloc)
+        kwargs.setdefault("timeout", TIMEOUT)
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.wait(attempt))
+                continue
+            if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                return response
+            time.sleep(self.wait(attempt, response.headers.get("Retry-After")))
+
+    def wait(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2**attempt
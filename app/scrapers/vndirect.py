@@ -1,10 +1,10 @@
 import argparse
 import json
-import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import numpy as np
 import pandas as pd
@@ -12,6 +12,7 @@ import pytz
 import requests
 
 from app import slack
+from app.scrapers.session import RATE, PooledSession
 from app.utils import write_to_log
 
 warnings.filterwarnings("ignore")
@@ -134,63 +135,161 @@ class Ticker:
 
 class FinancialStatement(Ticker):
     LOG_NAME = "vnd_financial_statement"
-
-    def scrape(self, tickers: List[int] = None, years: List[int] = None) -> None:
+    API = "https://finfo-api.vndirect.com.vn"
+    COLUMNS = ["ticker", "name", "code", "value", "date"]
+    KEYS = ["ticker", "code", "date"]
+    WORKERS = 4
+    # days after a quarter end during which its statements may still be
+    # published piecemeal (quarterly reports are due within 45 days)
+    GRACE = 45
+
+    def __init__(self, session: PooledSession = None):
+        self.session = session or PooledSession(headers=self.HEADERS)
+
+    def scrape(
+        self,
+        tickers: List[int] = None,
+        years: List[int] = None,
+        workers: int = None,
+        full: bool = False,
+    ) -> None:
+        """
+        Tickers are scraped by a pool of threads sharing one session,
+        whose per-host token bucket replaces the fixed sleep between tickers.
+        Unless `full` or `years` are given, only quarters after the latest stored
+        fiscal date are requested, so up-to-date tickers send no request.
+        The latest stored quarter is requested again for GRACE days after its
+        end, as its statements may have been only partly published.
+        """
         if not tickers:
             tickers = Ticker().read_tickers()
-        if not args.years:
+        # explicit years are a backfill, request them whatever is stored
+        full = full or bool(years)
+        if not years:
             years = [y for y in range(2000, datetime.now().year + 1)]
-
-        for ticker in tickers:
-            if len(ticker) == 3:
-                file_path = f"data/{self.LOG_NAME}_{ticker}.csv"
-                self.init_dataframe(file_path)
-                print(self.data.shape)
-                self.get_item_codes(ticker)
-                print(self.item_codes)
-                if not self.item_codes:
-                    continue
-                else:
-                    self.get_item_values(ticker, years)
-                self.write_data(file_path)
-            time.sleep(5)
+        tickers = [ticker for ticker in tickers if len(ticker) == 3]
+        index = self.read_index()
+
+        with ThreadPoolExecutor(max_workers=workers or self.WORKERS) as executor:
+            futures = {
+                executor.submit(
+                    FinancialStatement(self.session).scrape_ticker,
+                    ticker,
+                    years,
+                    None if full else index.get(ticker),
+                    full,
+                ): ticker
+                for ticker in tickers
+            }
+            for i, future in enumerate(as_completed(futures), start=1):
+                ticker = futures[future]
+                try:
+                    rows, latest = future.result()
+                    status = f"{rows} new rows, latest {latest}"
+                    if latest is not None:
+                        index[ticker] = max(latest, index.get(ticker, latest))
+                except Exception as e:
+                    status = f"failed ({e})"
+                    write_to_log(self.LOG_NAME, f"{ticker}: {status}")
+                print(f"[{i}/{len(tickers)}] {ticker}: {status}")
+        self.write_index(index)
 
         message = "Successfuly obtained financial statements"
         slack.send_message(message)
 
+    def scrape_ticker(
+        self, ticker: str, years: List[int], since: str = None, full: bool = False
+    ) -> Tuple[int, str]:
+        """
+        New rows of a ticker and its latest stored fiscal date.
+        """
+        file_path = f"data/{self.LOG_NAME}_{ticker}.csv"
+        if since is not None and not self.get_quarters_string(years, since):
+            return 0, since
+        self.init_dataframe(file_path)
+        if since is None and not full and self.stored:
+            # not indexed yet, start from the stored file
+            since = max(date for _, _, date in self.stored)
+        if not self.get_quarters_string(years, since):
+            return 0, since
+
+        self.get_item_codes(ticker)
+        if not self.item_codes:
+            return 0, since
+        self.get_item_values(ticker, years, since)
+        rows = self.write_data(file_path)
+        dates = [date for _, _, date in self.stored]
+        return rows, max(dates, default=None)
+
+    def index_path(self) -> str:
+        return f"data/{self.LOG_NAME}_index.json"
+
+    def read_index(self) -> Dict[str, str]:
+        """
+        Latest stored fiscal date of each ticker.
+        """
+        if not Path(self.index_path()).exists():
+            return {}
+        return json.load(open(self.index_path()))
+
+    def write_index(self, index: Dict[str, str]) -> None:
+        json.dump(index, open(self.index_path(), "w"), indent=4, sort_keys=True)
+
     def init_dataframe(self, file_path: str) -> None:
+        """
+        Only the keys of the stored rows are loaded, new rows are appended.
+        """
         file = Path(file_path)
         if file.exists():
-            self.data = pd.read_csv(file_path, index_col=False)
+            stored = pd.read_csv(file_path, usecols=self.KEYS, dtype=str)
+            self.stored = set(stored.itertuples(index=False, name=None))
         else:
-            self.data = pd.DataFrame(
-                None, index=None, columns=["ticker", "name", "code", "value", "date"]
-            )
+            self.stored = set()
+        self.data = pd.DataFrame(None, index=None, columns=self.COLUMNS)
 
-    def write_data(self, file_path: str) -> None:
-        self.data.to_csv(file_path, index=False)
+    def write_data(self, file_path: str) -> int:
+        """
+        Append the rows whose (ticker, code, date) is not in the file yet.
+        """
+        keys = self.data[self.KEYS].astype(str).itertuples(index=False, name=None)
+        new = self.data[[key not in self.stored for key in keys]]
+        new = new.drop_duplicates(subset=self.KEYS)
+        if new.empty:
+            return 0
+        new.to_csv(
+            file_path, mode="a", header=not Path(file_path).exists(), index=False
+        )
+        self.stored.update(
+            new[self.KEYS].astype(str).itertuples(index=False, name=None)
+        )
+        return len(new)
 
-    def get_quarters_string(self, years: List[int]) -> str:
+    def get_quarters_string(self, years: List[int], since: str = None) -> str:
         quarters_string = ""
         today = datetime.now()
+        grace = timedelta(days=self.GRACE)
         for year in years:
             for date in ["12-31", "09-30", "06-30", "03-31"]:
                 date_string = str(year) + "-" + date
                 dt = datetime.strptime(date_string, "%Y-%m-%d")
-                if dt < today:
+                if dt < today and (
+                    since is None
+                    or date_string > since
+                    or (date_string == since and today - dt <= grace)
+                ):
                     quarters_string += date_string + ","
 
         return quarters_string[:-1]
 
     def get_item_codes(self, ticker: str) -> None:
         statements = {
-            "balance_sheet_items": f"https://finfo-api.vndirect.com.vn/v4/financial_models?sort=displayOrder:asc&q=codeList:{ticker}~modelType:1,89,101,411~note:TT199/2014/TT-BTC,TT334/2016/TT-BTC,TT49/2014/TT-NHNN,TT202/2014/TT-BTC~displayLevel:0,1,2,3&size=1000",
-            "income_statement_items": f"https://finfo-api.vndirect.com.vn/v4/financial_models?sort=displayOrder:asc&q=codeList:{ticker}~modelType:2,90,102,412~note:TT199/2014/TT-BTC,TT334/2016/TT-BTC,TT49/2014/TT-NHNN,TT202/2014/TT-BTC~displayLevel:0,1,2,3&size=1000",
-            "cash_flow_items": f"https://finfo-api.vndirect.com.vn/v4/financial_models?sort=displayOrder:asc&q=codeList:{ticker}~modelType:3,91,103,413~note:TT199/2014/TT-BTC,TT334/2016/TT-BTC,TT49/2014/TT-NHNN,TT202/2014/TT-BTC~displayLevel:0,1,2,3&size=1000",
+            "balance_sheet_items": f"{self.API}/v4/financial_models?sort=displayOrder:asc&q=codeList:{ticker}~modelType:1,89,101,411~note:TT199/2014/TT-BTC,TT334/2016/TT-BTC,TT49/2014/TT-NHNN,TT202/2014/TT-BTC~displayLevel:0,1,2,3&size=1000",
+            "income_statement_items": f"{self.API}/v4/financial_models?sort=displayOrder:asc&q=codeList:{ticker}~modelType:2,90,102,412~note:TT199/2014/TT-BTC,TT334/2016/TT-BTC,TT49/2014/TT-NHNN,TT202/2014/TT-BTC~displayLevel:0,1,2,3&size=1000",
+            "cash_flow_items": f"{self.API}/v4/financial_models?sort=displayOrder:asc&q=codeList:{ticker}~modelType:3,91,103,413~note:TT199/2014/TT-BTC,TT334/2016/TT-BTC,TT49/2014/TT-NHNN,TT202/2014/TT-BTC~displayLevel:0,1,2,3&size=1000",
         }
         self.item_codes = {}
         for statement, url in statements.items():
-            response = requests.get(url, headers=self.HEADERS)
+            response = self.session.get(url)
             try:
                 js = json.loads(response.content)
                 for data in js["data"]:
@@ -201,44 +300,45 @@ class FinancialStatement(Ticker):
                 )
                 continue
 
-    def get_item_values(self, ticker: str, years: List[int]) -> None:
-        quarters_string = self.get_quarters_string(years)
-        balance_sheet_values = f"https://finfo-api.vndirect.com.vn/v4/financial_statements?q=code:{ticker}~reportType:QUARTER~modelType:1,89,101,411~fiscalDate:{quarters_string}&sort=fiscalDate&size=9999"
-        income_statement_values = f"https://finfo-api.vndirect.com.vn/v4/financial_statements?q=code:{ticker}~reportType:QUARTER~modelType:2,90,102,412~fiscalDate:{quarters_string}&sort=fiscalDate&size=9999"
-        cash_flow_values = f"https://finfo-api.vndirect.com.vn/v4/financial_statements?q=code:{ticker}~reportType:QUARTER~modelType:3,91,103,413~fiscalDate:{quarters_string}&sort=fiscalDate&size=9999"
+    def get_item_values(self, ticker: str, years: List[int], since: str = None) -> None:
+        quarters_string = self.get_quarters_string(years, since)
+        balance_sheet_values = f"{self.API}/v4/financial_statements?q=code:{ticker}~reportType:QUARTER~modelType:1,89,101,411~fiscalDate:{quarters_string}&sort=fiscalDate&size=9999"
+        income_statement_values = f"{self.API}/v4/financial_statements?q=code:{ticker}~reportType:QUARTER~modelType:2,90,102,412~fiscalDate:{quarters_string}&sort=fiscalDate&size=9999"
+        cash_flow_values = f"{self.API}/v4/financial_statements?q=code:{ticker}~reportType:QUARTER~modelType:3,91,103,413~fiscalDate:{quarters_string}&sort=fiscalDate&size=9999"
 
         values = [balance_sheet_values, income_statement_values, cash_flow_values]
 
+        records = []
         for value in values:
-            response = requests.get(
-                value,
-                headers=self.HEADERS,
-            )
+            response = self.session.get(value)
             try:
                 js = json.loads(response.content)
-                for data in js["data"]:
-                    self.get_item(ticker, data)
+                records += [self.get_item(ticker, data) for data in js["data"]]
             except json.decoder.JSONDecodeError:
                 write_to_log(
                     self.LOG_NAME, f"Failed to obtain {value} for {ticker} for {years}"
                 )
                 continue
+        records = [record for record in records if record is not None]
+        self.data = pd.DataFrame.from_records(records, columns=self.COLUMNS)
 
-    def get_item(self, ticker, data) -> None:
+    def get_item(self, ticker, data) -> Tuple:
         try:
-            row = {}
-            row["ticker"] = ticker
-            row["name"] = self.item_codes[data["itemCode"]]
-            row["code"] = data["itemCode"]
-            row["value"] = data["numericValue"]
-            row["date"] = data["fiscalDate"]
-            self.data = self.data.append(row, ignore_index=True)
+            return (
+                ticker,
+                self.item_codes[data["itemCode"]],
+                data["itemCode"],
+                data["numericValue"],
+                data["fiscalDate"],
+            )
         except Exception:
-            pass
+            return None
 
 
 # etc
-# python3 -m app.scrapers.vndirect --scraper FinancialStatement --start 2023
+# python3 -m app.scrapers.vndirect --scraper FinancialStatement --years 2023
+# python3 -m app.scrapers.vndirect --scraper FinancialStatement --workers 8 --rate 4
+# python3 -m app.scrapers.vndirect --scraper FinancialStatement --full
 
 # or
 # ipython
@@ -270,12 +370,39 @@ if __name__ == "__main__":
         required=False,
     )
 
+    parser.add_argument(
+        "--workers",
+        help="Tickers scraped concurrently.",
+        type=int,
+        default=FinancialStatement.WORKERS,
+    )
+    parser.add_argument(
+        "--rate",
+        help="Requests per second to each API host.",
+        type=float,
+        default=RATE,
+    )
+    parser.add_argument(
+        "--api",
+        help="Financial statements API, e.g. a local stand-in server.",
+        type=str,
+        default=FinancialStatement.API,
+    )
+
+    parser.add_argument(
+        "--full",
+        help="Request every quarter, not only those after the stored ones.",
+        action="store_true",
+    )
+
     args = parser.parse_args()
     scraper = args.scraper
     class_object = globals()[scraper]
 
     if scraper == "FinancialStatement":
-        class_object().scrape(args.tickers, args.years)
+        FinancialStatement.API = args.api
+        session = PooledSession(rate=args.rate, headers=Ticker.HEADERS)
+        class_object(session).scrape(args.tickers, args.years, args.workers, args.full)
     else:
         class_object().scrape()
 